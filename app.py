@@ -1,334 +1,617 @@
+import base64
+import importlib
+import tempfile
+import time
+
 import dash
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output, State
-import pandas as pd
-import numpy as np
-import numpy_financial as npf
+from dash import dcc, html, Input, Output, State, Patch
 import plotly.graph_objects as go
-import plotly.express as px
-from datetime import datetime
-from weasyprint import HTML
-import base64
-import io
+
+import batch
+import bulk_report
+import cache
+import charts
+import engine
+import metrics
+import model_graph
+import montecarlo
+import optimizer
+import profiles
+import report
+
+# Heavy modules only some requests need (tables, Parquet, PDF export) are imported on
+# first use. A preforking server calls preload() so its workers share them copy-on-write.
+DEFERRED_MODULES = ['pandas', 'pyarrow.parquet', 'pyarrow.csv', 'kaleido', 'weasyprint']
 
 # ==============================================================================
 # APP INITIALIZATION
 # ==============================================================================
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX])
-server = app.server
+_app = None
+
+def create_app():
+    """Build the Dash app: layout, callbacks, and the portfolio, profile, bulk report and /metrics routes."""
+    started = time.perf_counter()
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX])
+    app.layout = build_layout()
+    register_callbacks(app)
+    batch.register_routes(app.server)
+    profiles.register_routes(app.server)
+    bulk_report.register_routes(app.server)
+    metrics.register_routes(app.server, app)
+    metrics.record_startup(time.perf_counter() - started)
+    return app
+
+def preload():
+    """Import DEFERRED_MODULES now; skips PDF libraries whose native dependencies are missing."""
+    for name in DEFERRED_MODULES:
+        try:
+            importlib.import_module(name)
+        except (ImportError, OSError):
+            pass
+
+def __getattr__(name):
+    # `app.app` and `app.server` (as in `gunicorn app:server`) build the app on first access.
+    global _app
+    if name in ('app', 'server'):
+        if _app is None:
+            _app = create_app()
+        return _app if name == 'app' else _app.server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ==============================================================================
 # APPLICATION LAYOUT - WITH "RUN SIMULATION" BUTTON
 # ==============================================================================
-app.layout = dbc.Container(fluid=True, children=[
-    dcc.Store(id='calculation-results-store'),
+# Uncertain quantities offered in the Monte Carlo panel: name, label, default spread (%).
+MC_SPREAD_FIELDS = [('grid_price', 'Grid Price', 15), ('feed_in_tariff', 'Feed-in Tariff', 10),
+                    ('inflation', 'Inflation', 25), ('co2_price', 'CO₂ Price', 30),
+                    ('capex', 'CAPEX', 10), ('pv_yield', 'PV Yield', 7)]
+# Axis labels of the numeric inputs in the tornado chart.
+INPUT_LABELS = {'sim_years': 'Simulation Years', 'pv_size': 'PV System Size', 'battery_size': 'Battery Size',
+                'ev_demand': 'Annual EV Demand', 'pv_cost': 'PV System Cost', 'battery_cost': 'Battery Cost',
+                'infra_cost': 'Infrastructure Cost', 'om_pct': 'O&M Cost', 'grid_price': 'Grid Electricity Price',
+                'feed_in_tariff': 'Feed-in Tariff', 'inflation': 'Inflation Rate', 'loan_coverage': 'Loan Coverage',
+                'interest_rate': 'Loan Interest Rate', 'depreciation_rate': 'Depreciation Rate',
+                'tax_rate': 'Corporate Tax Rate', 'grid_co2_kg': 'Grid CO₂ Intensity', 'co2_price': 'CO₂ Price'}
+
+def build_layout():
+    return dbc.Container(fluid=True, children=[
+        dcc.Store(id='calculation-results-store'),
+        dcc.Store(id='montecarlo-results-store'),
     
-    html.Div(
-        dbc.Container(
-            html.H2("EV Charging + Solar Feasibility Dashboard", className="my-3 text-primary")
-        ), className="bg-light p-3 mb-4 rounded-3"
-    ),
-
-    dbc.Row([
-        # --- LEFT COLUMN: CONTROL PANEL (INPUTS) ---
-        dbc.Col(width=12, lg=4, children=[
-            dbc.Card(body=True, children=[
-                html.H4("Input Parameters", className="card-title mb-4"),
-                dbc.Accordion(always_open=True, children=[
-                    # --- Accordion items for inputs (code unchanged, truncated for brevity) ---
-                    dbc.AccordionItem(title="1. Project Setup", children=[
-                        dbc.Row([
-                            dbc.Col(html.Label("Project Name", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.Input(id="project-name", value="My Charging Hub"), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        html.Div([
-                            html.Label("Simulation Years", className="form-label"),
-                            dcc.Slider(id="simulation-years", min=5, max=25, step=1, value=20, marks=None, tooltip={"placement": "bottom", "always_visible": True})
-                        ], className="mb-3 mt-4"),
+        html.Div(
+            dbc.Container(
+                html.H2("EV Charging + Solar Feasibility Dashboard", className="my-3 text-primary")
+            ), className="bg-light p-3 mb-4 rounded-3"
+        ),
+
+        dbc.Row([
+            # --- LEFT COLUMN: CONTROL PANEL (INPUTS) ---
+            dbc.Col(width=12, lg=4, children=[
+                dbc.Card(body=True, children=[
+                    html.H4("Input Parameters", className="card-title mb-4"),
+                    dbc.Accordion(always_open=True, children=[
+                        # --- Accordion items for inputs (code unchanged, truncated for brevity) ---
+                        dbc.AccordionItem(title="1. Project Setup", children=[
+                            dbc.Row([
+                                dbc.Col(html.Label("Project Name", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.Input(id="project-name", value="My Charging Hub"), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            html.Div([
+                                html.Label("Simulation Years", className="form-label"),
+                                dcc.Slider(id="simulation-years", min=5, max=25, step=1, value=20, marks=None, tooltip={"placement": "bottom", "always_visible": True})
+                            ], className="mb-3 mt-4"),
+                        ]),
+                        dbc.AccordionItem(title="2. Energy System", children=[
+                            dbc.Row([
+                                dbc.Col(html.Label("PV System Size", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="pv-size", type="number", value=150), dbc.InputGroupText("kWp")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Battery Storage Size", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="battery-size", type="number", value=200), dbc.InputGroupText("kWh")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Annual EV Demand", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="ev-demand", type="number", value=300000), dbc.InputGroupText("kWh/yr")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Switch(id="hourly-dispatch", label="Hourly battery dispatch (8760 h/yr)", value=False, className="mt-2"),
+                            html.Label("Site Meter Data", className="form-label mt-3"),
+                            dcc.Upload(id="site-data-upload", children=html.Div(["Drop or ", html.A("select"), " a 15-min CSV/Parquet file"]),
+                                       className="border rounded text-center text-muted p-2 mb-2", style={'borderStyle': 'dashed'}),
+                            dbc.Row([
+                                dbc.Col(html.Label("Site Profile ID", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="site-profile", placeholder="Upload, or paste an id from the API", debounce=True),
+                                                        dbc.Button("Clear", id="btn-clear-site-profile", color="light")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Metered PV Capacity", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="site-pv-capacity", type="number", min=0), dbc.InputGroupText("kWp")]), width=12, sm=7)
+                            ], className="mb-2 align-items-center"),
+                            html.Div(id="site-profile-summary", className="small text-muted"),
+                        ]),
+                        dbc.AccordionItem(title="3. Financial Assumptions", children=[
+                            dbc.Row([
+                                dbc.Col(html.Label("PV System Cost", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="pv-cost", type="number", value=900), dbc.InputGroupText("€/kWp")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Battery Cost", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="battery-cost", type="number", value=450), dbc.InputGroupText("€/kWh")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Infrastructure Cost", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="infra-cost", type="number", value=100000), dbc.InputGroupText("€")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("O&M Cost", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="om-cost-pct", type="number", value=1.5, step=0.1), dbc.InputGroupText("%/yr")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Grid Electricity Price", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="grid-price", type="number", value=0.18, step=0.01), dbc.InputGroupText("€/kWh")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Feed-in Tariff", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="feed-in-tariff", type="number", value=0.07, step=0.01), dbc.InputGroupText("€/kWh")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Annual Inflation Rate", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="inflation-pct", type="number", value=2.0, step=0.1), dbc.InputGroupText("%")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                        ]),
+                         dbc.AccordionItem(title="4. Taxes, Loans & Incentives", children=[
+                            dbc.Row([
+                                dbc.Col(html.Label("Loan Coverage", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="loan-coverage-pct", type="number", value=70, min=0, max=100), dbc.InputGroupText("%")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Loan Interest Rate", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="interest-rate-pct", type="number", value=4.5, step=0.1), dbc.InputGroupText("%")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Depreciation Rate", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="depreciation-pct", type="number", value=8.0, step=0.1), dbc.InputGroupText("%")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Corporate Tax Rate", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="tax-rate-pct", type="number", value=25), dbc.InputGroupText("%")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Grid CO₂ Intensity", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="grid-co2-intensity", type="number", value=0.401, step=0.01), dbc.InputGroupText("kg/kWh")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("CO₂ Price", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id="co2-price", type="number", value=35), dbc.InputGroupText("€/ton")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                        ]),
+                        dbc.AccordionItem(title="5. Uncertainty (Monte Carlo)", children=[
+                            dbc.Row([
+                                dbc.Col(html.Label("Draws", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.Input(id="mc-draws", type="number", value=10000, min=1000, max=1000000, step=1000), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Random Seed", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.Input(id="mc-seed", type="number", value=42, min=0, step=1), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                            dbc.Row([
+                                dbc.Col(html.Label("Distribution", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.Select(id="mc-distribution", value="normal", options=[
+                                    {'label': 'Normal (spread = 1σ)', 'value': 'normal'},
+                                    {'label': 'Uniform (± spread)', 'value': 'uniform'},
+                                    {'label': 'Triangular (± spread)', 'value': 'triangular'}]), width=12, sm=7)
+                            ], className="mb-3 align-items-center"),
+                        ] + [
+                            dbc.Row([
+                                dbc.Col(html.Label(f"{label} Spread", className="col-form-label"), width=12, sm=5),
+                                dbc.Col(dbc.InputGroup([dbc.Input(id=f"mc-spread-{name}", type="number", value=spread, min=0, step=1), dbc.InputGroupText("± %")]), width=12, sm=7)
+                            ], className="mb-3 align-items-center")
+                            for name, label, spread in MC_SPREAD_FIELDS
+                        ] + [
+                            dbc.Button("Run Monte Carlo", id="btn-run-montecarlo", color="secondary", className="w-100"),
+                        ]),
                     ]),
-                    dbc.AccordionItem(title="2. Energy System", children=[
-                        dbc.Row([
-                            dbc.Col(html.Label("PV System Size", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="pv-size", type="number", value=150), dbc.InputGroupText("kWp")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Battery Storage Size", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="battery-size", type="number", value=200), dbc.InputGroupText("kWh")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
+                    # --- ACTION BUTTONS ---
+                    dbc.Row([
+                        dbc.Col(dbc.Button("Run Simulation", id="btn-run-simulation", color="success", className="w-100"), width=6),
+                        dbc.Col(dbc.Button("Download PDF Report", id="btn-pdf-export", color="primary", className="w-100"), width=6),
+                    ], className="mt-4"),
+                    dbc.Switch(id="live-update", label="Recompute as you type", value=False, className="mt-3"),
+                    html.Div(id="pdf-progress-container", style={'display': 'none'}, className="mt-3",
+                             children=dbc.Progress(id="pdf-progress", value=0, striped=True, animated=True)),
+                    dcc.Store(id='pdf-job-store'),
+                    dcc.Interval(id='pdf-job-poll', interval=500, disabled=True),
+                    dcc.Download(id="download-pdf"),
+                ])
+            ]),
+
+            # --- RIGHT COLUMN: DASHBOARD (OUTPUTS) ---
+            dbc.Col(width=12, lg=8, children=[
+                dbc.Row([
+                    dbc.Col(dbc.Card(id="kpi-npv-card", body=True, className="text-center")),
+                    dbc.Col(dbc.Card(id="kpi-irr-card", body=True, className="text-center")),
+                    dbc.Col(dbc.Card(id="kpi-payback-card", body=True, className="text-center")),
+                    dbc.Col(dbc.Card(id="kpi-co2-card", body=True, className="text-center")),
+                ]),
+                dbc.Tabs([
+                    dbc.Tab(dcc.Graph(id="cash-flow-chart", figure=charts.cash_flow_figure()), label="Financial Performance"),
+                    dbc.Tab(dcc.Graph(id="co2-chart", figure=charts.co2_figure()), label="CO₂ Impact"),
+                    dbc.Tab(html.Div(id="financial-data-table", className="mt-4"), label="Data Table"),
+                    dbc.Tab(label="Optimizer", children=[
                         dbc.Row([
-                            dbc.Col(html.Label("Annual EV Demand", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="ev-demand", type="number", value=300000), dbc.InputGroupText("kWh/yr")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
+                            dbc.Col([html.Label("PV Range (kWp)", className="form-label"), dbc.InputGroup([
+                                dbc.Input(id="opt-pv-min", type="number", value=0, min=0), dbc.Input(id="opt-pv-max", type="number", value=500, min=0)])], width=12, md=3),
+                            dbc.Col([html.Label("Battery Range (kWh)", className="form-label"), dbc.InputGroup([
+                                dbc.Input(id="opt-battery-min", type="number", value=0, min=0), dbc.Input(id="opt-battery-max", type="number", value=1000, min=0)])], width=12, md=3),
+                            dbc.Col([html.Label("Grid Steps", className="form-label"),
+                                dbc.Input(id="opt-steps", type="number", value=100, min=3, max=200, step=1)], width=6, md=2),
+                            dbc.Col([html.Label("Search", className="form-label"), dbc.Select(id="opt-method", value="grid", options=[
+                                {'label': 'Full grid', 'value': 'grid'}, {'label': 'Coarse-to-fine', 'value': 'refine'}])], width=6, md=2),
+                            dbc.Col([html.Label("Objective", className="form-label"), dbc.Select(id="opt-metric", value="npv", options=[
+                                {'label': 'NPV', 'value': 'npv'}, {'label': 'IRR', 'value': 'irr'}])], width=6, md=2),
+                        ], className="mt-4 align-items-end"),
+                        dbc.Button("Run Optimizer", id="btn-run-optimizer", color="secondary", className="mt-3"),
+                        html.Div(id="optimizer-result", className="mt-3 text-center"),
+                        dcc.Graph(id="optimizer-heatmap"),
                     ]),
-                    dbc.AccordionItem(title="3. Financial Assumptions", children=[
-                        dbc.Row([
-                            dbc.Col(html.Label("PV System Cost", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="pv-cost", type="number", value=900), dbc.InputGroupText("€/kWp")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Battery Cost", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="battery-cost", type="number", value=450), dbc.InputGroupText("€/kWh")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Infrastructure Cost", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="infra-cost", type="number", value=100000), dbc.InputGroupText("€")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("O&M Cost", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="om-cost-pct", type="number", value=1.5, step=0.1), dbc.InputGroupText("%/yr")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Grid Electricity Price", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="grid-price", type="number", value=0.18, step=0.01), dbc.InputGroupText("€/kWh")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
+                    dbc.Tab(label="Risk Analysis", children=[
+                        html.Div(id="risk-summary", className="mt-4 text-center text-muted"),
                         dbc.Row([
-                            dbc.Col(html.Label("Feed-in Tariff", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="feed-in-tariff", type="number", value=0.07, step=0.01), dbc.InputGroupText("€/kWh")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Annual Inflation Rate", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="inflation-pct", type="number", value=2.0, step=0.1), dbc.InputGroupText("%")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
+                            dbc.Col(dcc.Graph(id="npv-histogram"), width=12, xl=6),
+                            dbc.Col(dcc.Graph(id="irr-histogram"), width=12, xl=6),
+                        ]),
                     ]),
-                     dbc.AccordionItem(title="4. Taxes, Loans & Incentives", children=[
-                        dbc.Row([
-                            dbc.Col(html.Label("Loan Coverage", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="loan-coverage-pct", type="number", value=70, min=0, max=100), dbc.InputGroupText("%")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Loan Interest Rate", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="interest-rate-pct", type="number", value=4.5, step=0.1), dbc.InputGroupText("%")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Depreciation Rate", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="depreciation-pct", type="number", value=8.0, step=0.1), dbc.InputGroupText("%")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
+                    dbc.Tab(label="Sensitivity", children=[
                         dbc.Row([
-                            dbc.Col(html.Label("Corporate Tax Rate", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="tax-rate-pct", type="number", value=25), dbc.InputGroupText("%")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("Grid CO₂ Intensity", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="grid-co2-intensity", type="number", value=0.401, step=0.01), dbc.InputGroupText("kg/kWh")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
-                        dbc.Row([
-                            dbc.Col(html.Label("CO₂ Price", className="col-form-label"), width=12, sm=5),
-                            dbc.Col(dbc.InputGroup([dbc.Input(id="co2-price", type="number", value=35), dbc.InputGroupText("€/ton")]), width=12, sm=7)
-                        ], className="mb-3 align-items-center"),
+                            dbc.Col([html.Label("Input Swing", className="form-label"), dbc.InputGroup([
+                                dbc.Input(id="sensitivity-swing", type="number", value=10, min=1, max=50, step=1), dbc.InputGroupText("± %")])], width=6, md=3),
+                            dbc.Col([html.Label("Metric", className="form-label"), dbc.Select(id="sensitivity-metric", value="npv", options=[
+                                {'label': 'NPV', 'value': 'npv'}, {'label': 'IRR', 'value': 'irr'}])], width=6, md=3),
+                        ], className="mt-4 align-items-end"),
+                        dcc.Graph(id="tornado-chart"),
                     ]),
-                ]),
-                # --- ACTION BUTTONS ---
-                dbc.Row([
-                    dbc.Col(dbc.Button("Run Simulation", id="btn-run-simulation", color="success", className="w-100"), width=6),
-                    dbc.Col(dbc.Button("Download PDF Report", id="btn-pdf-export", color="primary", className="w-100"), width=6),
-                ], className="mt-4"),
-                dcc.Download(id="download-pdf"),
-            ])
-        ]),
-
-        # --- RIGHT COLUMN: DASHBOARD (OUTPUTS) ---
-        dbc.Col(width=12, lg=8, children=[
-            dbc.Row([
-                dbc.Col(dbc.Card(id="kpi-npv-card", body=True, className="text-center")),
-                dbc.Col(dbc.Card(id="kpi-irr-card", body=True, className="text-center")),
-                dbc.Col(dbc.Card(id="kpi-payback-card", body=True, className="text-center")),
-                dbc.Col(dbc.Card(id="kpi-co2-card", body=True, className="text-center")),
+                ], className="mt-4")
             ]),
-            dbc.Tabs([
-                dbc.Tab(dcc.Graph(id="cash-flow-chart"), label="Financial Performance"),
-                dbc.Tab(dcc.Graph(id="co2-chart"), label="CO₂ Impact"),
-                dbc.Tab(html.Div(id="financial-data-table", className="mt-4"), label="Data Table"),
-            ], className="mt-4")
-        ]),
+        ])
     ])
-])
+
+# ==============================================================================
+# MODEL RESULTS
+# ==============================================================================
+# Intermediate results of the last scenario, so an edit only re-runs the stages it affects.
+model = model_graph.ModelGraph()
+
+def compute_results(inputs):
+    """Run one scenario through the model graph and format it for the dashboard and report."""
+    with metrics.timed('model'):
+        result = model.evaluate(with_site_shapes(inputs), hourly=inputs.get('hourly_dispatch', False))
+    return engine.result_set(inputs, result)
+
+def apply_site_profile(inputs, profile_id, pv_capacity):
+    """Replace the EV demand (and, given the metered PV capacity, the PV yield) with a site profile's measurements."""
+    profile = profiles.load(profile_id) if profile_id else None
+    if profile:
+        inputs.update(profiles.annual_inputs(profile, pv_capacity), site_profile=profile_id)
+    return inputs
+
+def with_site_shapes(inputs):
+    # The measured hourly shapes are looked up by profile id, so they never enter cache keys or stores.
+    return {**inputs, **profiles.shapes(inputs.get('site_profile'))}
+
+def cached_results(store):
+    """Cached result set for the key in `store`, labelled with the project name it was last run under."""
+    data = cache.results.get(store['key']) if store else None
+    if data and 'project_name' in store:
+        # The cache key leaves the name out, so the entry may have been computed under another one.
+        data['inputs']['project_name'] = store['project_name']
+    return data
+
+def matching_monte_carlo(mc_store, store):
+    """Cached Monte Carlo summary if it was run for the same inputs as the results in `store`, else None."""
+    if not mc_store or not store or mc_store['results_key'] != store['key']:
+        return None
+    return cache.results.get(mc_store['key'])
+
+def patch_fcf_bands(fig, mc_data):
+    # Show (or hide) the Monte Carlo P10-P90 band and median on the cash flow chart.
+    for index, key in [(charts.FCF_P90, 'p90'), (charts.FCF_BAND, 'p10'), (charts.FCF_P50, 'p50')]:
+        fig['data'][index]['x'] = mc_data['years'] if mc_data else []
+        fig['data'][index]['y'] = mc_data['cash_flow'][key] if mc_data else []
+        fig['data'][index]['visible'] = bool(mc_data)
 
 # ==============================================================================
 # CALLBACKS
 # ==============================================================================
 
-# --- MASTER CALLBACK: Run all calculations triggered by BUTTON CLICK ---
-@app.callback(
-    Output('calculation-results-store', 'data'),
-    # TRIGGER:
-    Input('btn-run-simulation', 'n_clicks'),
-    # GATHER ALL INPUTS AS STATE:
-    [State(component_id, 'value') for component_id in [
-        'project-name', 'simulation-years', 'pv-size', 'battery-size', 'ev-demand',
-        'pv-cost', 'battery-cost', 'infra-cost', 'om-cost-pct', 'grid-price',
-        'feed-in-tariff', 'inflation-pct', 'loan-coverage-pct', 'interest-rate-pct',
-        'depreciation-pct', 'tax-rate-pct', 'grid-co2-intensity', 'co2-price']],
-    prevent_initial_call=True
-)
-def run_all_calculations(n_clicks, *args):
-    # This function now only runs when the "Run Simulation" button is clicked.
-    if n_clicks is None or any(v is None for v in args):
+# --- MASTER CALLBACK: Run all calculations triggered by BUTTON CLICK (or any input edit in live mode) ---
+def run_all_calculations(n_clicks, live_update, hourly_dispatch, site_profile, pv_capacity, *args):
+    # Input edits only recompute in live mode; otherwise the "Run Simulation" button does.
+    if dash.ctx.triggered_id != 'btn-run-simulation' and not live_update:
+        raise dash.exceptions.PreventUpdate
+    if any(v is None for v in args):
+        raise dash.exceptions.PreventUpdate
+
+    # --- Results are looked up by input hash; the browser only keeps the cache key ---
+    inputs = apply_site_profile(engine.parse_inputs(args), site_profile, pv_capacity)
+    inputs['hourly_dispatch'] = bool(hourly_dispatch)
+    key, _ = cache.results.get_or_compute(inputs, compute_results)
+    return {'key': key, 'project_name': inputs['project_name']}
+
+# --- SITE DATA CALLBACKS: ingest uploaded meter data, then show the selected profile ---
+def ingest_site_data(contents, n_clicks, filename):
+    if dash.ctx.triggered_id == 'btn-clear-site-profile':
+        return '', dash.no_update
+    if not contents:
         raise dash.exceptions.PreventUpdate
+    # Browser uploads arrive base64-encoded in memory; large files go through POST /api/profiles or the CLI.
+    with tempfile.TemporaryFile() as source:
+        source.write(base64.b64decode(contents.split(',', 1)[1]))
+        source.seek(0)
+        try:
+            profile = profiles.ingest(source, profiles.infer_format(filename))
+        except ValueError as e:
+            return dash.no_update, dbc.Alert(f"Could not use {filename}: {e}", color="danger", className="p-2")
+    return profile['id'], dash.no_update
 
-    # --- Calculation logic (unchanged) ---
-    inputs = {'project_name': args[0], 'sim_years': args[1], 'pv_size': args[2], 'battery_size': args[3],
-        'ev_demand': args[4], 'pv_cost': args[5], 'battery_cost': args[6], 'infra_cost': args[7], 'om_pct': args[8] / 100,
-        'grid_price': args[9], 'feed_in_tariff': args[10], 'inflation': args[11] / 100, 'loan_coverage': args[12] / 100,
-        'interest_rate': args[13] / 100, 'depreciation_rate': args[14] / 100, 'tax_rate': args[15] / 100,
-        'grid_co2_kg': args[16], 'co2_price': args[17]}
-    AVG_GEN_PER_KWP, PV_DEGRADATION, SELF_CONSUMPTION_RATIO = 1100, 0.005, 0.4
-    years = np.arange(1, inputs['sim_years'] + 1)
-    pv_generation = inputs['pv_size'] * AVG_GEN_PER_KWP * (1 - PV_DEGRADATION) ** (years - 1)
-    self_consumed_energy = pv_generation * SELF_CONSUMPTION_RATIO
-    grid_import = np.maximum(0, inputs['ev_demand'] - self_consumed_energy)
-    grid_export = pv_generation - self_consumed_energy
-    capex_total = (inputs['pv_size'] * inputs['pv_cost']) + (inputs['battery_size'] * inputs['battery_cost']) + inputs['infra_cost']
-    inflation_factor = (1 + inputs['inflation']) ** (years - 1)
-    opex_om = (capex_total * inputs['om_pct']) * inflation_factor
-    opex_grid_cost = grid_import * inputs['grid_price'] * inflation_factor
-    total_opex = opex_om + opex_grid_cost
-    revenue_feed_in = grid_export * inputs['feed_in_tariff'] * inflation_factor
-    co2_saved_tons = (self_consumed_energy * inputs['grid_co2_kg']) / 1000
-    revenue_co2 = co2_saved_tons * inputs['co2_price'] * inflation_factor
-    total_revenue = revenue_feed_in + revenue_co2
-    annual_depreciation = capex_total * inputs['depreciation_rate']
-    loan_amount = capex_total * inputs['loan_coverage']
-    interest_payment = loan_amount * inputs['interest_rate']
-    ebitda = total_revenue - total_opex
-    ebit = ebitda - annual_depreciation
-    ebt = ebit - interest_payment
-    tax_on_ebt = np.maximum(0, ebt * inputs['tax_rate'])
-    net_income = ebt - tax_on_ebt
-    free_cash_flow = np.insert(ebit * (1 - inputs['tax_rate']) + annual_depreciation, 0, -capex_total)
-    npv = npf.npv(inputs['interest_rate'], free_cash_flow)
-    irr = npf.irr(free_cash_flow) * 100
-    try: payback_year = np.where(np.cumsum(free_cash_flow) > 0)[0][0]
-    except IndexError: payback_year = "N/A"
-    df = pd.DataFrame({'Year': years, 'Revenue (€)': total_revenue, 'OPEX (€)': total_opex, 'EBITDA (€)': ebitda,
-        'Depreciation (€)': annual_depreciation, 'Net Income (€)': net_income, 'Free Cash Flow (€)': free_cash_flow[1:]})
-    co2_df = pd.DataFrame({'Year': years, 'Baseline Emissions (tons)': (inputs['ev_demand'] * inputs['grid_co2_kg']) / 1000,
-        'Project Emissions (tons)': (grid_import * inputs['grid_co2_kg']) / 1000})
-    co2_df['CO₂ Saved (tons)'] = co2_df['Baseline Emissions (tons)'] - co2_df['Project Emissions (tons)']
-    return {'inputs': inputs, 'kpis': {'npv': f"€ {npv:,.0f}", 'irr': f"{irr:.2f} %", 'payback': f"Year {payback_year}",
-        'co2_saved': f"{co2_df['CO₂ Saved (tons)'].sum():,.0f} tons"}, 'cash_flow_df': df.to_dict('records'),
-        'co2_df': co2_df.to_dict('records'), 'free_cash_flow_data': free_cash_flow.tolist()}
+def describe_site_profile(profile_id, pv_capacity):
+    # A measured load replaces the EV demand input, which is shown but locked while the profile is used.
+    profile = profiles.load(profile_id) if profile_id else None
+    if not profile:
+        message = "Unknown profile id; using the synthetic profiles." if profile_id else "Using the synthetic EV and PV profiles."
+        return message, dash.no_update, False
+    measured = profiles.annual_inputs(profile, pv_capacity)
+    lines = [f"{profile['interval_minutes']:g}-min readings, {profile['rows']:,} rows ({profile['invalid_rows']:,} invalid)."]
+    if profile.get('load_shape') is not None:
+        lines.append(f"Load: {profile['annual_load_kwh']:,.0f} kWh/yr over {', '.join(profile['load_years'])}.")
+    if profile.get('pv_shape') is not None:
+        yield_text = f" = {measured['pv_yield']:,.0f} kWh/kWp" if 'pv_yield' in measured else " (enter the metered capacity to use its yield)"
+        lines.append(f"PV: {profile['annual_pv_kwh']:,.0f} kWh/yr{yield_text}.")
+    ev_demand = round(measured['ev_demand']) if 'ev_demand' in measured else dash.no_update
+    return [html.Div(line) for line in lines], ev_demand, 'ev_demand' in measured
+
+# --- MONTE CARLO CALLBACK: Run uncertainty draws triggered by BUTTON CLICK ---
+def run_monte_carlo(n_clicks, draws, seed, distribution, *args):
+    n = len(MC_SPREAD_FIELDS)
+    spreads, (hourly_dispatch, site_profile, pv_capacity), values = args[:n], args[n:n + 3], args[n + 3:]
+    if n_clicks is None or draws is None or seed is None or any(v is None for v in spreads + values) \
+            or distribution not in montecarlo.DISTRIBUTIONS:
+        raise dash.exceptions.PreventUpdate
+
+    inputs = apply_site_profile(engine.parse_inputs(values), site_profile, pv_capacity)
+    inputs['hourly_dispatch'] = bool(hourly_dispatch)
+    spec = {name: {'dist': distribution, 'spread': spread / 100} for (name, _, _), spread in zip(MC_SPREAD_FIELDS, spreads)}
+    draws = int(min(max(draws, 1000), 1000000))
+    key, _ = cache.results.get_or_compute(
+        {**inputs, 'spec': spec, 'draws': draws, 'seed': int(seed)},
+        lambda _: montecarlo.run(with_site_shapes(inputs), spec, draws, seed=int(seed), hourly=inputs['hourly_dispatch']),
+        namespace='montecarlo')
+    # The summary stays server-side; `results_key` ties it to the results of the same inputs.
+    return {'key': key, 'results_key': cache.make_key(inputs)}
 
 # --- UI UPDATE CALLBACK: Populate dashboard from stored results ---
-@app.callback(
-    [Output('kpi-npv-card', 'children'), Output('kpi-irr-card', 'children'), Output('kpi-payback-card', 'children'),
-     Output('kpi-co2-card', 'children'), Output('cash-flow-chart', 'figure'), Output('co2-chart', 'figure'),
-     Output('financial-data-table', 'children')],
-    Input('calculation-results-store', 'data')
-)
-def update_dashboard(data):
+def update_dashboard(store, mc_store):
+    # Figures are patched in place: only the trace data travels, not the figure layout and styling.
+    with metrics.timed('cache'):
+        data = cached_results(store)
+    fig_cash_flow, fig_co2 = Patch(), Patch()
     if not data:
-        # On initial load, display empty placeholders
+        # On initial load (or once cached results have expired), display empty placeholders
+        message = "Results expired. Please run the simulation again." if store else "No data yet. Please run a simulation."
         empty_card = [html.H4("---"), html.H5("Run Simulation")]
-        empty_fig = go.Figure().update_layout(template="plotly_white", annotations=[dict(text="No data yet. Please run a simulation.", showarrow=False)])
+        for fig, traces in [(fig_cash_flow, range(charts.FCF_P50 + 1)), (fig_co2, range(len(charts.CO2_COLUMNS)))]:
+            for index in traces:
+                fig['data'][index]['x'], fig['data'][index]['y'] = [], []
+            fig['layout']['annotations'] = charts.placeholder_layout(message)['annotations']
         empty_table = html.Div("Simulation results will be shown here.", className="text-center text-muted mt-5")
-        return empty_card, empty_card, empty_card, empty_card, empty_fig, empty_fig, empty_table
+        return empty_card, empty_card, empty_card, empty_card, fig_cash_flow, fig_co2, empty_table
 
-    kpis, cash_flow_df, co2_df = data['kpis'], pd.DataFrame(data['cash_flow_df']), pd.DataFrame(data['co2_df'])
+    kpis, cash_flow_df, co2_df = data['kpis'], data['cash_flow_df'], data['co2_df']
     kpi_npv = [html.H4("NPV"), html.H5(kpis['npv'], className="text-success")]
     kpi_irr = [html.H4("IRR"), html.H5(kpis['irr'], className="text-success")]
     kpi_payback = [html.H4("Payback"), html.H5(kpis['payback'], className="text-primary")]
     kpi_co2 = [html.H4("CO₂ Saved"), html.H5(kpis['co2_saved'], className="text-info")]
-    fig_cash_flow = go.Figure()
-    fig_cash_flow.add_trace(go.Bar(x=cash_flow_df['Year'], y=cash_flow_df['Revenue (€)'], name='Revenue', marker_color='green'))
-    fig_cash_flow.add_trace(go.Bar(x=cash_flow_df['Year'], y=cash_flow_df['OPEX (€)'], name='OPEX', marker_color='red'))
-    fig_cash_flow.add_trace(go.Scatter(x=cash_flow_df['Year'], y=cash_flow_df['Free Cash Flow (€)'], name='Free Cash Flow', mode='lines+markers', line=dict(color='royalblue', width=3)))
-    fig_cash_flow.update_layout(title_text="Annual Financial Performance", barmode='group', template="plotly_white")
-    fig_co2 = px.bar(co2_df, x='Year', y=['Baseline Emissions (tons)', 'Project Emissions (tons)'],
-                     title='Annual CO₂ Emissions: Baseline vs. Project',
-                     labels={'value': 'CO₂ Emissions (tons)'}, template="plotly_white", barmode='group')
-    table = dbc.Table.from_dataframe(cash_flow_df.round(0), striped=True, bordered=True, hover=True, responsive=True)
+    for index, column in [(charts.REVENUE, 'Revenue (€)'), (charts.OPEX, 'OPEX (€)'), (charts.FREE_CASH_FLOW, 'Free Cash Flow (€)')]:
+        fig_cash_flow['data'][index]['x'], fig_cash_flow['data'][index]['y'] = cash_flow_df['Year'], cash_flow_df[column]
+    patch_fcf_bands(fig_cash_flow, matching_monte_carlo(mc_store, store))
+    for index, column in enumerate(charts.CO2_COLUMNS):
+        fig_co2['data'][index]['x'], fig_co2['data'][index]['y'] = co2_df['Year'], co2_df[column]
+    fig_cash_flow['layout']['annotations'] = fig_co2['layout']['annotations'] = []
+    rows = zip(*cash_flow_df.values())
+    table = dbc.Table([html.Thead(html.Tr([html.Th(column) for column in cash_flow_df])),
+                       html.Tbody([html.Tr([html.Td(round(value)) for value in row]) for row in rows])],
+                      striped=True, bordered=True, hover=True, responsive=True)
     return kpi_npv, kpi_irr, kpi_payback, kpi_co2, fig_cash_flow, fig_co2, table
 
-# --- PDF EXPORT CALLBACK (unchanged, but now uses the stored data) ---
-@app.callback(
-    Output("download-pdf", "data"),
-    Input("btn-pdf-export", "n_clicks"),
-    [State('calculation-results-store', 'data'), State('cash-flow-chart', 'figure'), State('co2-chart', 'figure')],
-    prevent_initial_call=True,
-)
-def generate_pdf_report(n_clicks, data, cash_flow_fig_data, co2_fig_data):
+# --- MONTE CARLO OVERLAY CALLBACK: Patch the FCF bands when new Monte Carlo results arrive ---
+def update_monte_carlo_overlay(mc_store, store):
+    fig_cash_flow = Patch()
+    patch_fcf_bands(fig_cash_flow, matching_monte_carlo(mc_store, store))
+    return fig_cash_flow
+
+# --- RISK VIEW CALLBACK: NPV/IRR histograms from Monte Carlo results ---
+def update_risk_view(mc_store):
+    mc_data = cache.results.get(mc_store['key']) if mc_store else None
+    if not mc_data:
+        message = "Results expired. Please run Monte Carlo again." if mc_store else "No data yet. Please run Monte Carlo."
+        empty_fig = go.Figure().update_layout(**charts.placeholder_layout(message))
+        return "Configure distributions under \"5. Uncertainty\" and click \"Run Monte Carlo\".", empty_fig, empty_fig
+    npv, irr = mc_data['npv'], mc_data['irr']
+    npv_text = " / ".join("N/A" if npv[k] is None else f"€ {npv[k]:,.0f}" for k in ('p10', 'p50', 'p90'))
+    irr_text = " / ".join("N/A" if irr[k] is None else f"{irr[k]:.2f} %" for k in ('p10', 'p50', 'p90'))
+    summary = [html.H5(f"{mc_data['draws']:,} draws (seed {mc_data['seed']})"),
+               html.P(f"NPV P10 / P50 / P90: {npv_text} — IRR P10 / P50 / P90: {irr_text} — "
+                      f"P(NPV > 0): {mc_data['prob_npv_positive']:.1%} — IRR undefined: {mc_data['irr_undefined']:.1%}")]
+    figures = []
+    for stats, title, unit in [(npv, 'NPV Distribution', 'NPV (€)'), (irr, 'IRR Distribution', 'IRR (%)')]:
+        fig = go.Figure(go.Bar(x=stats['hist_x'], y=stats['hist_y'], marker_color='royalblue', name='Draws'))
+        for key, dash_style in [('p10', 'dot'), ('p50', 'dash'), ('p90', 'dot')]:
+            if stats[key] is not None:
+                fig.add_vline(x=stats[key], line_dash=dash_style, annotation_text=key.upper())
+        fig.update_layout(title_text=title, xaxis_title=unit, yaxis_title='Draws', bargap=0.05, template="plotly_white")
+        figures.append(fig)
+    return summary, *figures
+
+# --- SENSITIVITY CALLBACK: Tornado chart of one-at-a-time input swings ---
+def update_sensitivity(store, swing, metric):
+    data = cached_results(store)
+    if not data or not swing:
+        return go.Figure().update_layout(template="plotly_white", annotations=[dict(text="No data yet. Please run a simulation.", showarrow=False)])
+
+    inputs, swing = data['inputs'], min(max(swing, 1), 50) / 100
+    _, tornado = cache.results.get_or_compute(
+        {**inputs, 'swing': swing, 'metric': metric},
+        lambda _: dict(zip(('base', 'rows'), model.sensitivity(with_site_shapes(inputs), inputs.get('hourly_dispatch', False), swing, metric))),
+        namespace='sensitivity')
+    base, rows = tornado['base'], tornado['rows'][::-1]   # largest impact on top
+    label, unit = ('NPV', '€') if metric == 'npv' else ('IRR', '%')
+    labels = [INPUT_LABELS[row['key']] for row in rows]
+    fig = go.Figure()
+    for side, name, color in [('low', f'Input −{swing:.0%}', 'indianred'), ('high', f'Input +{swing:.0%}', 'seagreen')]:
+        fig.add_trace(go.Bar(y=labels, x=[row[side] - base for row in rows], base=base, orientation='h', name=name,
+                             marker_color=color, customdata=[[row[f'{side}_input'], row[side]] for row in rows],
+                             hovertemplate=f"%{{y}} = %{{customdata[0]:,.4g}}<br>{label}: %{{customdata[1]:,.2f}} {unit}<extra></extra>"))
+    fig.add_vline(x=base, line_dash='dash', annotation_text=f"Base {label}")
+    fig.update_layout(title_text=f"{label} Sensitivity (± {swing:.0%} per input)", xaxis_title=f"{label} ({unit})",
+                      barmode='overlay', template="plotly_white", height=600)
+    return fig
+
+# --- OPTIMIZER CALLBACK: Sweep PV x battery designs triggered by BUTTON CLICK ---
+def run_optimizer(n_clicks, pv_min, pv_max, battery_min, battery_max, steps, method, metric, hourly_dispatch,
+                  site_profile, pv_capacity, *args):
+    if n_clicks is None or any(v is None for v in (pv_min, pv_max, battery_min, battery_max, steps) + args) \
+            or metric not in optimizer.METRICS:
+        raise dash.exceptions.PreventUpdate
+
+    inputs = with_site_shapes(apply_site_profile(engine.parse_inputs(args), site_profile, pv_capacity))
+    steps = int(min(max(steps, 3), 200))
+    grid, optimum = optimizer.optimize(inputs, (pv_min, max(pv_min, pv_max)), (battery_min, max(battery_min, battery_max)),
+                                       steps=steps, metric=metric, method=method, hourly=bool(hourly_dispatch))
+    label, unit = ('NPV', '€') if metric == 'npv' else ('IRR', '%')
+    fig = go.Figure(go.Heatmap(x=grid['pv_sizes'], y=grid['battery_sizes'], z=grid[metric], colorscale='Viridis',
+                               colorbar=dict(title=f"{label} ({unit})")))
+    if optimum is None:
+        result = html.H5(f"No design has a defined {label} in this range.", className="text-muted")
+    else:
+        pv_best, battery_best, value = optimum
+        fig.add_trace(go.Scatter(x=[pv_best], y=[battery_best], mode='markers', name='Optimum',
+                                 marker=dict(symbol='star', size=18, color='red', line=dict(color='white', width=1))))
+        value_text = f"€ {value:,.0f}" if metric == 'npv' else f"{value:.2f} %"
+        result = html.H5(f"Best design: {pv_best:,.1f} kWp PV + {battery_best:,.1f} kWh battery — {label} {value_text}", className="text-success")
+    if hourly_dispatch and method == 'grid':
+        result = html.Div([result, html.Small("With hourly dispatch the designs are searched coarse-to-fine instead of on the full grid.",
+                                              className="text-muted")])
+    fig.update_layout(title_text=f"{label} by PV and Battery Size", xaxis_title="PV System Size (kWp)",
+                      yaxis_title="Battery Storage Size (kWh)", template="plotly_white")
+    return result, fig
+
+# --- PDF EXPORT CALLBACKS: queue a background report job, then poll it until the PDF is ready ---
+def generate_pdf_report(n_clicks, store, mc_store):
+    data = cached_results(store)
     if n_clicks is None or not data:
-        # Prevent download if no simulation has been run
-        return dash.no_update
-
-    # --- PDF Generation logic (unchanged) ---
-    inputs, kpis, cash_flow_df = data['inputs'], data['kpis'], pd.DataFrame(data['cash_flow_df'])
-    df_display = cash_flow_df.copy()
-    for col in df_display.columns:
-        if '€' in col: df_display[col] = df_display[col].apply(lambda x: f'€ {x:,.0f}')
-    table_html = df_display.to_html(index=False, classes='results-table', border=0)
-    cash_flow_fig, co2_fig = go.Figure(cash_flow_fig_data), go.Figure(co2_fig_data)
-    for fig in [cash_flow_fig, co2_fig]:
-        fig.update_layout(margin=dict(l=60, r=40, t=80, b=60), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
-    cash_flow_img_bytes = cash_flow_fig.to_image(format="png", width=900, height=450, scale=2)
-    co2_img_bytes = co2_fig.to_image(format="png", width=900, height=450, scale=2)
-    cash_flow_img_b64 = base64.b64encode(cash_flow_img_bytes).decode('utf-8')
-    co2_img_b64 = base64.b64encode(co2_img_bytes).decode('utf-8')
-    logo_b64 = "data:image/svg+xml;base64,PHN2ZyB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciIHdpZHRoPSIyNCIgaGVpZ2h0PSIyNCIgdmlld0JveD0iMCAwIDI0IDI0IiBmaWxsPSJub25lIiBzdHJva2U9IiMwZDZlZmQiIHN0cm9rZS13aWR0aD0iMiIgc3Ryb2tlLWxpbmVjYXA9InJvdW5kIiBzdHJva2UtbGluZWpvaW49InJvdW5kIiBjbGFzcz0ibHVjaWRlIGx1Y2lkZS1wb3dlciI+PHBhdGggZD0iTTIgMTJoMjAiLz48cGF0aCBkPSJNOSAxOHYtMWEzIDMgMCAwIDEgMy0zaDRhMyAzIDAgMCAxIDMgM3YxIi8+PHBhdGggZD0iTTcgNnYxYTMgMyAwIDAgMCAzIDNoNGEzIDMgMCAwIDAgMy0zVjYiLz48L3N2Zz4="
-    html_string = f"""
-    <html>
-        <head>
-            <title>Feasibility Report</title>
-            <style>
-                @import url('https://fonts.googleapis.com/css2?family=Lato:wght@400;700&display=swap');
-                body {{ font-family: 'Lato', sans-serif; margin: 0; padding: 0; font-size: 14px; color: #333; }}
-                @page {{ margin: 1in; }}
-                header {{ position: fixed; top: -0.6in; left: 0; right: 0; height: 50px; display: flex; align-items: center; border-bottom: 2px solid #0d6efd; padding: 0 0.5in; }}
-                .logo {{ height: 40px; width: 40px; margin-right: 15px; }}
-                .report-title {{ color: #0d6efd; font-size: 24px; font-weight: bold; }}
-                h2 {{ color: #333; border-bottom: 1px solid #ccc; padding-bottom: 8px; margin-top: 40px; font-size: 20px; }}
-                .kpi-container {{ display: flex; justify-content: space-between; text-align: center; margin: 30px 0; }}
-                .kpi-box {{ padding: 15px; border-radius: 5px; width: 23%; background-color: #f8f9fa; border: 1px solid #dee2e6;}}
-                .kpi-title {{ font-size: 0.9em; color: #6c757d; font-weight: bold; }}
-                .kpi-value {{ font-size: 1.6em; font-weight: bold; color: #000; margin-top: 5px; }}
-                .input-table {{ border-collapse: collapse; width: 100%; margin-top: 20px; }}
-                .input-table td {{ border: 1px solid #ddd; padding: 10px; }}
-                .input-table td:first-child {{ font-weight: bold; width: 25%; }}
-                .results-table {{ border-collapse: collapse; width: 100%; margin-top: 20px; font-size: 12px; }}
-                .results-table th, .results-table td {{ border: 1px solid #ddd; padding: 8px; text-align: right; }}
-                .results-table th {{ background-color: #f2f2f2; font-weight: bold; text-align: center; }}
-                .results-table tr:nth-child(even) {{ background-color: #f9f9f9; }}
-                .chart {{ margin-top: 30px; text-align: center; page-break-inside: avoid; }}
-                .chart img {{ max-width: 100%; }}
-                footer {{ position: fixed; bottom: -0.6in; left: 0; right: 0; height: 30px; text-align: center; font-size: 12px; color: #777; }}
-            </style>
-        </head>
-        <body>
-            <header>
-                <img src="{logo_b64}" class="logo">
-                <div class="report-title">Financial Feasibility Report</div>
-            </header>
-            <footer>Report for {inputs['project_name']} - Generated on {datetime.now().strftime('%Y-%m-%d')}</footer>
-            <main>
-                <h2>Executive Summary: Key Metrics</h2>
-                <div class="kpi-container">
-                    <div class="kpi-box"><div class="kpi-title">Net Present Value (NPV)</div><div class="kpi-value">{kpis['npv']}</div></div>
-                    <div class="kpi-box"><div class="kpi-title">Internal Rate of Return (IRR)</div><div class="kpi-value">{kpis['irr']}</div></div>
-                    <div class="kpi-box"><div class="kpi-title">Payback Period</div><div class="kpi-value">{kpis['payback']}</div></div>
-                    <div class="kpi-box"><div class="kpi-title">Lifetime CO₂ Saved</div><div class="kpi-value">{kpis['co2_saved']}</div></div>
-                </div>
-                <h2>Input Assumptions</h2>
-                <table class="input-table">
-                    <tr><td>Project Name</td><td>{inputs['project_name']}</td><td>PV System Size</td><td>{inputs['pv_size']} kWp</td></tr>
-                    <tr><td>Simulation Years</td><td>{inputs['sim_years']} years</td><td>Battery Size</td><td>{inputs['battery_size']} kWh</td></tr>
-                    <tr><td>Annual EV Demand</td><td>{inputs['ev_demand']:,} kWh/yr</td><td>Infrastructure Cost</td><td>€ {inputs['infra_cost']:,}</td></tr>
-                    <tr><td>PV System Cost</td><td>€ {inputs['pv_cost']:,}/kWp</td><td>Battery Cost</td><td>€ {inputs['battery_cost']:,}/kWh</td></tr>
-                    <tr><td>Grid Electricity Price</td><td>{inputs['grid_price']} €/kWh</td><td>Feed-in Tariff</td><td>{inputs['feed_in_tariff']} €/kWh</td></tr>
-                </table>
-                <h2>Visualizations</h2>
-                <div class="chart"><img src="data:image/png;base64,{cash_flow_img_b64}"></div>
-                <div class="chart"><img src="data:image/png;base64,{co2_img_b64}"></div>
-                <h2>Financial Data Table</h2>
-                {table_html}
-            </main>
-        </body>
-    </html>
-    """
-    pdf_bytes = HTML(string=html_string).write_pdf()
-    return dcc.send_bytes(pdf_bytes, f"Feasibility_Report_{inputs['project_name']}.pdf")
+        # Prevent export if no simulation has been run (or its results have expired)
+        raise dash.exceptions.PreventUpdate
+
+    # Charts are rebuilt from the cached results on the server; the browser only sends the cache keys.
+    job_id = report.jobs.submit(data, matching_monte_carlo(mc_store, store))
+    return {'job_id': job_id}, False, 0, "Queued", {'display': 'block'}
+
+def poll_pdf_report(n_intervals, job):
+    status = report.jobs.status(job['job_id']) if job else None
+    if status is None:
+        return dash.no_update, True, 0, "", {'display': 'none'}
+    if status['status'] == 'failed':
+        return dash.no_update, True, 100, status['message'], {'display': 'block'}
+    if status['status'] != 'done':
+        return dash.no_update, False, status['progress'], status['message'], {'display': 'block'}
+    filename, pdf_bytes = report.jobs.result(job['job_id'])
+    return dcc.send_bytes(pdf_bytes, filename), True, 100, status['message'], {'display': 'none'}
+
+def register_callbacks(app):
+    """Attach the callbacks above to `app`; create_app() calls it for every app it builds."""
+    app.callback(
+        Output('calculation-results-store', 'data'),
+        # TRIGGERS:
+        Input('btn-run-simulation', 'n_clicks'),
+        Input('live-update', 'value'),
+        Input('hourly-dispatch', 'value'),
+        Input('site-profile', 'value'), Input('site-pv-capacity', 'value'),
+        [Input(component_id, 'value') for component_id in engine.FIELD_IDS],
+        prevent_initial_call=True
+    )(run_all_calculations)
+    app.callback(
+        [Output('site-profile', 'value'), Output('site-profile-summary', 'children', allow_duplicate=True)],
+        Input('site-data-upload', 'contents'),
+        Input('btn-clear-site-profile', 'n_clicks'),
+        State('site-data-upload', 'filename'),
+        prevent_initial_call=True
+    )(ingest_site_data)
+    app.callback(
+        [Output('site-profile-summary', 'children'), Output('ev-demand', 'value'), Output('ev-demand', 'disabled')],
+        Input('site-profile', 'value'),
+        Input('site-pv-capacity', 'value'),
+    )(describe_site_profile)
+    app.callback(
+        Output('montecarlo-results-store', 'data'),
+        Input('btn-run-montecarlo', 'n_clicks'),
+        State('mc-draws', 'value'), State('mc-seed', 'value'), State('mc-distribution', 'value'),
+        [State(f'mc-spread-{name}', 'value') for name, _, _ in MC_SPREAD_FIELDS],
+        State('hourly-dispatch', 'value'),
+        State('site-profile', 'value'), State('site-pv-capacity', 'value'),
+        [State(component_id, 'value') for component_id in engine.FIELD_IDS],
+        prevent_initial_call=True
+    )(run_monte_carlo)
+    app.callback(
+        [Output('kpi-npv-card', 'children'), Output('kpi-irr-card', 'children'), Output('kpi-payback-card', 'children'),
+         Output('kpi-co2-card', 'children'), Output('cash-flow-chart', 'figure'), Output('co2-chart', 'figure'),
+         Output('financial-data-table', 'children')],
+        Input('calculation-results-store', 'data'),
+        State('montecarlo-results-store', 'data')
+    )(update_dashboard)
+    app.callback(
+        Output('cash-flow-chart', 'figure', allow_duplicate=True),
+        Input('montecarlo-results-store', 'data'),
+        State('calculation-results-store', 'data'),
+        prevent_initial_call=True
+    )(update_monte_carlo_overlay)
+    app.callback(
+        [Output('risk-summary', 'children'), Output('npv-histogram', 'figure'), Output('irr-histogram', 'figure')],
+        Input('montecarlo-results-store', 'data')
+    )(update_risk_view)
+    app.callback(
+        Output('tornado-chart', 'figure'),
+        Input('calculation-results-store', 'data'),
+        Input('sensitivity-swing', 'value'),
+        Input('sensitivity-metric', 'value'),
+    )(update_sensitivity)
+    app.callback(
+        [Output('optimizer-result', 'children'), Output('optimizer-heatmap', 'figure')],
+        Input('btn-run-optimizer', 'n_clicks'),
+        State('opt-pv-min', 'value'), State('opt-pv-max', 'value'), State('opt-battery-min', 'value'),
+        State('opt-battery-max', 'value'), State('opt-steps', 'value'), State('opt-method', 'value'), State('opt-metric', 'value'),
+        State('hourly-dispatch', 'value'),
+        State('site-profile', 'value'), State('site-pv-capacity', 'value'),
+        [State(component_id, 'value') for component_id in engine.FIELD_IDS],
+        prevent_initial_call=True
+    )(run_optimizer)
+    app.callback(
+        [Output('pdf-job-store', 'data'), Output('pdf-job-poll', 'disabled'), Output('pdf-progress', 'value'),
+         Output('pdf-progress', 'label'), Output('pdf-progress-container', 'style')],
+        Input("btn-pdf-export", "n_clicks"),
+        [State('calculation-results-store', 'data'), State('montecarlo-results-store', 'data')],
+        prevent_initial_call=True,
+    )(generate_pdf_report)
+    app.callback(
+        [Output("download-pdf", "data"), Output('pdf-job-poll', 'disabled', allow_duplicate=True),
+         Output('pdf-progress', 'value', allow_duplicate=True), Output('pdf-progress', 'label', allow_duplicate=True),
+         Output('pdf-progress-container', 'style', allow_duplicate=True)],
+        Input('pdf-job-poll', 'n_intervals'),
+        State('pdf-job-store', 'data'),
+        prevent_initial_call=True,
+    )(poll_pdf_report)
 
 # ==============================================================================
 # RUN APPLICATION
 # ==============================================================================
 if __name__ == '__main__':
-   app.run(debug=True)
+   create_app().run(debug=True)
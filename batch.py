@@ -0,0 +1,297 @@
+"""Headless portfolio evaluation.
+
+Reads a CSV, NDJSON or Parquet file of sites in chunks, evaluates each chunk
+with the vectorized engine on a process pool and streams KPIs back as NDJSON
+or Parquet as soon as each chunk is done. At most a few chunks are in flight
+at any time, so memory stays flat however many sites the file holds. No Dash
+components or Plotly figures are built.
+
+Columns use the same names as the dashboard inputs (`pv-size`, `ev-demand`,
+`grid-price`, ...); percentages are given in percent, as in the UI.
+
+    python batch.py sites.csv -o results.ndjson --cash-flows
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import engine
+import pool
+
+CHUNK_SIZE = 5000
+INPUT_FORMATS = ['csv', 'ndjson', 'parquet']
+OUTPUT_FORMATS = ['ndjson', 'parquet']
+KPI_COLUMNS = ['capex', 'npv', 'irr_pct', 'payback_year', 'co2_saved_tons']
+CASH_FLOW_COLUMNS = {'revenue': 'total_revenue', 'opex': 'total_opex', 'ebitda': 'ebitda', 'net_income': 'net_income'}
+
+
+# ==============================================================================
+# INPUT
+# ==============================================================================
+def infer_format(filename, default='csv'):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return {'jsonl': 'ndjson', 'json': 'ndjson', 'pq': 'parquet'}.get(extension, extension) or default
+
+
+def read_sites(source, fmt, chunk_size=CHUNK_SIZE):
+    """Yield DataFrames of at most `chunk_size` sites from a path or binary file object."""
+    import pandas as pd   # imported on first use, so the dashboard does not pay for it at startup
+    if fmt == 'csv':
+        yield from pd.read_csv(source, chunksize=chunk_size)
+    elif fmt == 'ndjson':
+        yield from pd.read_json(source, lines=True, chunksize=chunk_size)
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for record_batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            yield record_batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported input format '{fmt}', expected one of {INPUT_FORMATS}")
+
+
+# ==============================================================================
+# EVALUATION
+# ==============================================================================
+def check_columns(sites):
+    """Raise ValueError if a chunk of sites lacks one of the input columns."""
+    missing = [field_id for field_id in engine.FIELD_IDS[1:] if field_id not in sites.columns]
+    if missing:
+        raise ValueError(f"Missing input columns: {', '.join(missing)}")
+
+
+def parse_sites(sites):
+    """Model inputs of a chunk of sites as (N,) float arrays in model units, and the mask of valid rows.
+
+    Cells that are not numbers are read as NaN, which makes their row invalid.
+    """
+    import pandas as pd
+    check_columns(sites)
+    inputs = {key: pd.to_numeric(sites[field_id], errors='coerce').to_numpy(dtype=float) / (100 if is_pct else 1)
+              for field_id, key, is_pct in engine.INPUT_FIELDS[1:]}
+    valid = np.all([np.isfinite(values) for values in inputs.values()], axis=0)
+    valid &= (inputs['sim_years'] >= 1) & (inputs['sim_years'] <= 100)
+    return inputs, valid
+
+
+def evaluate_chunk(sites, offset=0, hourly=False, cash_flows=False):
+    """Evaluate one chunk of sites and return its result records as a DataFrame."""
+    import pandas as pd
+    inputs, valid = parse_sites(sites)
+    # Invalid rows are evaluated with a placeholder horizon and reported as invalid.
+    inputs['sim_years'] = np.where(valid, np.nan_to_num(inputs['sim_years'], nan=1), 1).astype(int)
+    result = engine.evaluate_batch(inputs, hourly=hourly)
+
+    names = sites['project-name'] if 'project-name' in sites.columns else pd.Series(np.arange(len(sites)) + offset).astype(str)
+    records = pd.DataFrame({
+        'site': np.arange(len(sites)) + offset,
+        'project_name': names.astype(str).to_numpy(),
+        'valid': valid,
+        'capex': result['capex_total'],
+        'npv': result['npv'],
+        'irr_pct': result['irr'] * 100,
+        'payback_year': np.where(result['payback'] >= 0, result['payback'], np.nan),
+        'co2_saved_tons': result['co2_saved'].sum(axis=1),
+    })
+    records.loc[~valid, KPI_COLUMNS] = np.nan
+    if cash_flows:
+        horizon = inputs['sim_years']
+        for column, key in CASH_FLOW_COLUMNS.items():
+            records[column] = [row[:n].tolist() if ok else None for row, n, ok in zip(result[key], horizon, valid)]
+        records['free_cash_flow'] = [row[:n + 1].tolist() if ok else None
+                                     for row, n, ok in zip(result['free_cash_flow'], horizon, valid)]
+    return records
+
+
+def evaluate_stream(chunks, hourly=False, cash_flows=False, workers=None):
+    """Evaluate an iterable of site chunks, yielding result chunks in input order.
+
+    Chunks are submitted lazily to the shared pool with at most two per
+    worker in flight, so the input is read only as fast as results are consumed.
+    """
+    tasks = ((chunk, offset, hourly, cash_flows) for offset, chunk in _with_offsets(chunks))
+    return pool.imap(evaluate_chunk, tasks, workers)
+
+
+def _with_offsets(chunks):
+    # Empty chunks (a file with only a header) have nothing to evaluate.
+    offset = 0
+    for chunk in chunks:
+        if len(chunk):
+            yield offset, chunk
+            offset += len(chunk)
+
+
+# ==============================================================================
+# OUTPUT
+# ==============================================================================
+class _StreamSink(io.RawIOBase):
+    """Write-only file object that hands out what was written so far, for streaming Parquet."""
+
+    def __init__(self):
+        self._buffer, self._position = bytearray(), 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._buffer = bytes(self._buffer), bytearray()
+        return data
+
+
+def _ndjson_lines(records):
+    # Pandas writes NaN as null; one JSON object per line.
+    return records.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n').encode('utf-8') + b'\n'
+
+
+def parquet_schema(cash_flows=False):
+    """Schema of the Parquet output, fixed up front so chunks without valid sites do not decide the column types."""
+    import pyarrow as pa
+    fields = [('site', pa.int64()), ('project_name', pa.string()), ('valid', pa.bool_())]
+    fields += [(column, pa.float64()) for column in KPI_COLUMNS]
+    if cash_flows:
+        fields += [(column, pa.list_(pa.float64())) for column in [*CASH_FLOW_COLUMNS, 'free_cash_flow']]
+    return pa.schema(fields)
+
+
+def encode_stream(result_chunks, out_fmt='ndjson', cash_flows=False):
+    """Yield encoded bytes for each result chunk as soon as it is available."""
+    if out_fmt == 'ndjson':
+        for records in result_chunks:
+            if len(records):
+                yield _ndjson_lines(records)
+    elif out_fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = parquet_schema(cash_flows)
+        sink = _StreamSink()
+        writer = pq.ParquetWriter(sink, schema)
+        for records in result_chunks:
+            writer.write_table(pa.Table.from_pandas(records, schema=schema, preserve_index=False))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+    else:
+        raise ValueError(f"Unsupported output format '{out_fmt}', expected one of {OUTPUT_FORMATS}")
+
+
+def run_portfolio(source, fmt, out_fmt='ndjson', hourly=False, cash_flows=False, chunk_size=CHUNK_SIZE, workers=None):
+    """Stream encoded results for every site in `source`.
+
+    The first chunk is read and checked before this returns, so an unreadable
+    file or missing columns raise ValueError here rather than mid-stream.
+    """
+    chunks = read_sites(source, fmt, chunk_size)
+    try:
+        first = next(chunks, None)
+        if first is not None:
+            check_columns(first)
+    except ValueError:
+        chunks.close()   # before the caller closes `source` under the reader
+        raise
+    if first is not None:
+        chunks = itertools.chain([first], chunks)
+    return encode_stream(evaluate_stream(chunks, hourly, cash_flows, workers), out_fmt, cash_flows)
+
+
+# ==============================================================================
+# FLASK ROUTE
+# ==============================================================================
+def register_routes(server):
+    """Register POST /api/portfolio on the Flask `server`.
+
+    Send the sites file as multipart field `file` (format inferred from its
+    name) or as the raw request body with `?format=csv|ndjson|parquet`.
+    Query options: `output=ndjson|parquet`, `cash_flows=1`, `hourly=1`.
+    """
+    from flask import Response, request, stream_with_context
+
+    @server.route('/api/portfolio', methods=['POST'])
+    def portfolio():
+        upload = request.files.get('file')
+        fmt = request.args.get('format') or infer_format(upload.filename if upload else None)
+        out_fmt = request.args.get('output', 'ndjson')
+        if fmt not in INPUT_FORMATS or out_fmt not in OUTPUT_FORMATS:
+            return Response(json.dumps({'error': f"Input must be one of {INPUT_FORMATS}, output one of {OUTPUT_FORMATS}"}),
+                            status=400, mimetype='application/json')
+        chunk_size = request.args.get('chunk_size', str(CHUNK_SIZE))
+        if not chunk_size.isdigit() or int(chunk_size) < 1:
+            return Response(json.dumps({'error': "chunk_size must be a positive integer"}),
+                            status=400, mimetype='application/json')
+        source = request.stream
+        spooled = upload is not None or fmt == 'parquet'
+        if spooled:
+            # Werkzeug closes parsed uploads when the view returns, and Parquet needs a seekable
+            # file, so these are copied to a private disk-backed file. Raw CSV/NDJSON bodies are
+            # read while the results stream back.
+            source = tempfile.TemporaryFile()
+            shutil.copyfileobj(upload.stream if upload else request.stream, source)
+            source.seek(0)
+        flag = lambda name: request.args.get(name, '').lower() in ('1', 'true', 'yes')
+        try:
+            # Reads the first chunk, so bad files are answered with 400 before any results are sent.
+            results = run_portfolio(source, fmt, out_fmt, flag('hourly'), flag('cash_flows'), int(chunk_size))
+        except ValueError as e:
+            if spooled:
+                source.close()
+            return Response(json.dumps({'error': str(e)}), status=400, mimetype='application/json')
+
+        @stream_with_context
+        def body():
+            try:
+                yield from results
+            finally:
+                if spooled:
+                    source.close()
+
+        mimetype = 'application/x-ndjson' if out_fmt == 'ndjson' else 'application/vnd.apache.parquet'
+        return Response(body(), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename=portfolio_results.{out_fmt}'})
+
+    return portfolio
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a portfolio of EV charging + solar sites.")
+    parser.add_argument('input', help="CSV, NDJSON or Parquet file of sites ('-' reads CSV/NDJSON from stdin)")
+    parser.add_argument('-o', '--output', default='-', help="output file, '-' for stdout (default)")
+    parser.add_argument('--input-format', choices=INPUT_FORMATS, help="defaults to the input file extension")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, help="defaults to the output file extension, else ndjson")
+    parser.add_argument('--cash-flows', action='store_true', help="include per-year cash flows for every site")
+    parser.add_argument('--hourly', action='store_true', help="use the hourly battery dispatch model")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=pool.WORKERS)
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+
+    fmt = args.input_format or infer_format(None if args.input == '-' else args.input)
+    out_fmt = args.output_format or (infer_format(args.output, 'ndjson') if args.output != '-' else 'ndjson')
+    source = sys.stdin.buffer if args.input == '-' else args.input
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        for data in run_portfolio(source, fmt, out_fmt, args.hourly, args.cash_flows, args.chunk_size, args.workers):
+            out.write(data)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Benchmark suite for the model, dashboard callbacks and PDF report.
+
+Each case is timed over several repetitions after one warm-up run; the cold
+start case runs a fresh interpreter that imports and builds the app, and also
+records its memory. Results are appended as one JSON line per run to a
+history file, tagged with the git revision, and compared with the previous
+run (or a given revision) so regressions between versions stand out.
+
+    python benchmark.py                       # run all cases, save and compare
+    python benchmark.py --cases kernel_1 kernel_n --repeat 20
+    python benchmark.py --compare 1a2b3c4 --fail-on-regression
+
+PDF cases are reported as skipped when kaleido's browser or WeasyPrint's
+native libraries are not available. `pdf_bulk` renders a portfolio of
+reports on all cores and is reported per report, so its inverse is the
+reports-per-second throughput to compare across core counts.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks.jsonl')
+REPEAT = 5
+SCENARIOS = 10000
+REGRESSION_THRESHOLD = 1.2   # median slower than this ratio counts as a regression
+BULK_REPORTS = 32            # reports per pdf_bulk repetition
+
+# Default dashboard values, in INPUT_FIELDS order.
+DEFAULT_VALUES = ['Benchmark Hub', 20, 150, 200, 300000, 900, 450, 100000, 1.5, 0.18, 0.07, 2.0, 70, 4.5, 8.0, 25, 0.401, 35]
+
+
+# ==============================================================================
+# CASES
+# ==============================================================================
+def _setup(scenarios):
+    """Import the app against a scratch cache and prepare shared inputs; returns a dict of fixtures."""
+    scratch = tempfile.mkdtemp(prefix='feasibility_bench_')
+    os.environ['FEASIBILITY_CACHE_PATH'] = os.path.join(scratch, 'cache.sqlite')
+    os.environ['FEASIBILITY_CHART_CACHE'] = os.path.join(scratch, 'charts')
+    import app
+    import engine
+    import model_graph
+
+    inputs = engine.parse_inputs(DEFAULT_VALUES)
+    rng = np.random.default_rng(0)
+    batch = {key: inputs[key] * rng.uniform(0.8, 1.2, scenarios) for key in engine.MODEL_KEYS}
+    batch['sim_years'] = rng.integers(10, 26, scenarios)
+    key, data = app.cache.results.get_or_compute({**inputs, 'hourly_dispatch': False}, app.compute_results)
+    return {'scratch': scratch, 'app': app, 'engine': engine, 'model_graph': model_graph, 'inputs': inputs,
+            'batch': batch, 'store': {'key': key}, 'data': data}
+
+
+def _cases(f):
+    app, engine, inputs = f['app'], f['engine'], f['inputs']
+    report = app.report
+
+    def compute_cold():
+        app.model = f['model_graph'].ModelGraph()
+        app.compute_results(inputs)
+
+    def compute_incremental():
+        # Alternate the CO₂ price so every call re-runs the stages downstream of it.
+        compute_incremental.co2_price = 40 if compute_incremental.co2_price == 35 else 35
+        app.compute_results({**inputs, 'co2_price': compute_incremental.co2_price})
+    compute_incremental.co2_price = 35
+
+    def pdf_kaleido():
+        # A fresh chart cache directory, so every repetition really renders.
+        shutil.rmtree(report.CHART_CACHE_DIR, ignore_errors=True)
+        for fig in report.report_figures(f['data']):
+            report.render_chart(fig)
+
+    pngs = {}
+
+    def pdf_weasyprint():
+        if not pngs:
+            pngs['charts'] = [report.render_chart(fig) for fig in report.report_figures(f['data'])]
+        report.typeset(report.report_html(f['data'], *pngs['charts']))
+
+    def pdf_bulk():
+        # Reports for a small portfolio on all cores, charts rendered afresh; the case time is per report.
+        import bulk_report
+        shutil.rmtree(report.CHART_CACHE_DIR, ignore_errors=True)
+        items = [{'inputs': {**inputs, 'pv_size': inputs['pv_size'] + i}} for i in range(BULK_REPORTS)]
+        summary = bulk_report.export(items, io.BytesIO(), batch_size=max(1, BULK_REPORTS // (2 * os.cpu_count())))
+        if summary['failed']:
+            raise RuntimeError(summary['failed'][0]['error'])
+    pdf_bulk.per_call = BULK_REPORTS
+
+    def cold_start():
+        # A fresh interpreter importing the app and building it, as a newly spawned worker would.
+        code = ("import json, time; started = time.perf_counter(); import app; app.create_app(); import metrics; "
+                "print(json.dumps({'startup_seconds': time.perf_counter() - started, **metrics.process_memory()}))")
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        cold_start.info = json.loads(out.stdout.splitlines()[-1])
+
+    return {
+        'cold_start': cold_start,
+        'kernel_1': lambda: engine.evaluate_batch(inputs),
+        'kernel_1_hourly': lambda: engine.evaluate_batch(inputs, hourly=True),
+        'kernel_n': lambda: engine.evaluate_batch(f['batch']),
+        'run_all_calculations': compute_cold,
+        'run_all_calculations_incremental': compute_incremental,
+        'update_dashboard': lambda: app.update_dashboard(f['store'], None),
+        'pdf_kaleido': pdf_kaleido,
+        'pdf_weasyprint': pdf_weasyprint,
+        'pdf_bulk': pdf_bulk,
+    }
+
+
+CASES = ['cold_start', 'kernel_1', 'kernel_1_hourly', 'kernel_n', 'run_all_calculations', 'run_all_calculations_incremental',
+         'update_dashboard', 'pdf_kaleido', 'pdf_weasyprint', 'pdf_bulk']
+
+
+def time_case(fn, repeat):
+    """Seconds per repetition of `fn` after one untimed warm-up call."""
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# ==============================================================================
+# HISTORY AND COMPARISON
+# ==============================================================================
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_reference(history, revision=None):
+    """The latest run of `revision`, or the latest run if `revision` is None."""
+    runs = [run for run in history if revision is None or run['revision'].startswith(revision)]
+    return runs[-1] if runs else None
+
+
+def compare(run, reference, threshold=REGRESSION_THRESHOLD):
+    """Print a table of median times against `reference`; return the names of regressed cases."""
+    regressions = []
+    print(f"{'case':<34}{'median':>12}{'min':>12}{'reference':>12}{'ratio':>8}")
+    for name, result in run['cases'].items():
+        if 'skipped' in result:
+            print(f"{name:<34}  skipped: {result['skipped']}")
+            continue
+        before = (reference or {}).get('cases', {}).get(name, {}).get('median')
+        ratio = result['median'] / before if before else None
+        flag = ' REGRESSION' if ratio and ratio > threshold else ''
+        if flag:
+            regressions.append(name)
+        reference_text = f"{before * 1000:>10.2f}ms" if before else ' ' * 12
+        ratio_text = f"{ratio:>7.2f}x" if ratio else ''
+        print(f"{name:<34}{result['median'] * 1000:>10.2f}ms{result['min'] * 1000:>10.2f}ms{reference_text}{ratio_text}{flag}")
+        if 'info' in result:
+            print(' ' * 4 + ', '.join(f"{key} {value / 2 ** 20:.1f} MiB" if key.endswith('ss') else f"{key} {value:.3f}"
+                                      for key, value in result['info'].items()))
+    if reference:
+        print(f"\nReference: {reference['revision']} from {reference['timestamp']}")
+    return regressions
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the feasibility model, callbacks and PDF report.")
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--scenarios', type=int, default=SCENARIOS, help="scenarios in the kernel_n batch")
+    parser.add_argument('--history', default=HISTORY_PATH, help="JSON lines file of past runs")
+    parser.add_argument('--compare', metavar='REVISION', help="compare with the latest run of this git revision "
+                                                              "(default: the previous run)")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--no-save', action='store_true', help="do not append this run to the history")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    fixtures = _setup(args.scenarios)
+    try:
+        cases, results = _cases(fixtures), {}
+        for name in args.cases:
+            try:
+                times = [seconds / getattr(cases[name], 'per_call', 1) for seconds in time_case(cases[name], args.repeat)]
+            except Exception as e:
+                results[name] = {'skipped': f"{type(e).__name__}: {e}".splitlines()[0][:200]}
+                continue
+            results[name] = {'median': statistics.median(times), 'min': min(times), 'mean': statistics.fmean(times),
+                             'repeat': args.repeat}
+            if hasattr(cases[name], 'info'):
+                results[name]['info'] = cases[name].info
+    finally:
+        shutil.rmtree(fixtures['scratch'], ignore_errors=True)
+
+    run = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'revision': git_revision(),
+           'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+           'scenarios': args.scenarios, 'cases': results}
+    history = load_history(args.history)
+    regressions = compare(run, find_reference(history, args.compare), args.threshold)
+    if not args.no_save:
+        with open(args.history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run) + '\n')
+    if regressions and args.fail_on_regression:
+        sys.exit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
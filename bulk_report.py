@@ -0,0 +1,306 @@
+"""Bulk PDF reports for whole portfolios.
+
+Renders one report per site on the shared worker pool (pool.py). Each
+worker starts its kaleido browser, parses the stylesheet and compiles the
+report template on its first batch and reuses them afterwards. A task is a batch of sites: their
+scenarios are evaluated as one vectorized model run and all their charts go
+through kaleido in a single call, then each report is typeset. Finished
+reports are written in site order into one ZIP archive (or one merged PDF)
+while later batches are still rendering, with progress reported per batch.
+
+Sites come from a CSV, NDJSON or Parquet file with the dashboard input
+columns (as for batch.py) or from the keys of cached results.
+
+    python bulk_report.py sites.csv -o reports.zip
+    python bulk_report.py --keys keys.txt -o portfolio.pdf --hourly
+"""
+import argparse
+import collections
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+import numpy as np
+
+import batch
+import cache
+import engine
+import pool
+import profiles
+import report
+
+BATCH_SIZE = 8             # sites per worker task
+OUTPUT_FORMATS = ['zip', 'pdf']
+OUTPUT_DIR = os.environ.get('FEASIBILITY_BULK_REPORT_DIR', os.path.join(tempfile.gettempdir(), 'feasibility_bulk_reports'))
+
+
+# ==============================================================================
+# SITES
+# ==============================================================================
+def read_scenarios(source, fmt, hourly=False):
+    """Scenario items (model inputs, as from the dashboard) for every row of a sites file.
+
+    Rows are parsed and validated as in batch.py; invalid ones are kept and
+    reported as such instead of failing the export.
+    """
+    items = []
+    for sites in batch.read_sites(source, fmt):
+        inputs, valid = batch.parse_sites(sites)
+        names = sites['project-name'] if 'project-name' in sites.columns else None
+        for i in range(len(sites)):
+            # Whole numbers stay ints, as typed in the dashboard, so the report prints them as such.
+            scenario = {key: int(values[i]) if float(values[i]).is_integer() else float(values[i]) for key, values in inputs.items()}
+            scenario['project_name'] = str(names.iloc[i]) if names is not None else f"Site {len(items) + 1}"
+            scenario['hourly_dispatch'] = hourly
+            items.append({'inputs': scenario, 'valid': bool(valid[i])})
+    return items
+
+
+def cached_items(keys):
+    """Items for results already in the result cache, looked up by the workers."""
+    return [{'key': key} for key in keys]
+
+
+def _results(items):
+    # Result sets of the items that have them, evaluating scenarios per (site profile, energy model)
+    # group as one vectorized batch; None for items that cannot be evaluated.
+    data, groups = [None] * len(items), collections.defaultdict(list)
+    for i, item in enumerate(items):
+        if 'key' in item:
+            data[i] = cache.results.get(item['key'])
+        elif item['valid']:
+            inputs = item['inputs']
+            groups[inputs.get('site_profile'), bool(inputs.get('hourly_dispatch'))].append(i)
+    for (profile_id, hourly), indices in groups.items():
+        scenarios = [items[i]['inputs'] for i in indices]
+        inputs = {key: [s[key] for s in scenarios] for key in engine.MODEL_KEYS}
+        inputs['pv_yield'] = [s.get('pv_yield', engine.AVG_GEN_PER_KWP) for s in scenarios]
+        inputs['sim_years'] = np.asarray(inputs['sim_years'], dtype=int)
+        result = engine.evaluate_batch({**inputs, **profiles.shapes(profile_id)}, hourly=hourly)
+        for row, i in enumerate(indices):
+            data[i] = engine.result_set(scenarios[row], result, row)
+    return data
+
+
+# ==============================================================================
+# WORKERS
+# ==============================================================================
+def report_filename(position, data):
+    name = re.sub(r'[^\w\-]+', '_', str(data['inputs']['project_name'])).strip('_') or 'site'
+    return f"{position + 1:04d}_{name}.pdf"
+
+
+def render_batch(items, offset=0):
+    """Render the reports of a batch of items; returns (filename, pdf bytes or None, error or None) per item."""
+    data = _results(items)
+    ok = [i for i, result in enumerate(data) if result is not None]
+    reports = [(f"{offset + i + 1:04d}_{item['key'][:12]}.pdf", None, "Result not in cache") if 'key' in item
+               else (report_filename(offset + i, item), None, "Invalid inputs") for i, item in enumerate(items)]
+    try:
+        figures = [fig for i in ok for fig in report.report_figures(data[i])]
+        pngs = report.render_charts(figures)
+    except Exception as e:
+        return [(report_filename(offset + i, data[i]), None, f"Chart rendering failed: {e}") if i in ok else reports[i]
+                for i in range(len(items))]
+    for n, i in enumerate(ok):
+        filename = report_filename(offset + i, data[i])
+        try:
+            reports[i] = (filename, report.typeset(report.report_html(data[i], *pngs[2 * n:2 * n + 2])), None)
+        except Exception as e:
+            reports[i] = (filename, None, f"Typesetting failed: {e}")
+    return reports
+
+
+def render_stream(items, workers=None, batch_size=BATCH_SIZE):
+    """Yield the rendered reports of `items` in order, one list per batch, from the shared pool."""
+    batches = ((items[start:start + batch_size], start) for start in range(0, len(items), batch_size))
+    return pool.imap(render_batch, batches, workers)
+
+
+# ==============================================================================
+# OUTPUT
+# ==============================================================================
+def export(items, out, out_fmt='zip', workers=None, batch_size=BATCH_SIZE, progress=None):
+    """Render a report for every item and write them to the binary file `out` as one ZIP or merged PDF.
+
+    `progress(done, total)` is called after each batch. Returns a summary
+    dict with the number of reports, the failures and the elapsed time.
+    """
+    if out_fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{out_fmt}', expected one of {OUTPUT_FORMATS}")
+    progress = progress or (lambda done, total: None)
+    started, done, failed = time.perf_counter(), 0, []
+    if out_fmt == 'zip':
+        # PDFs are compressed already, so they are stored as they are.
+        archive = zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED)
+        add = archive.writestr
+    else:
+        from pypdf import PdfWriter
+        writer = PdfWriter()
+        add = lambda filename, pdf: writer.append(io.BytesIO(pdf), outline_item=filename[5:-4])
+    try:
+        for reports in render_stream(items, workers, batch_size):
+            for filename, pdf, error in reports:
+                if error:
+                    failed.append({'file': filename, 'error': error})
+                else:
+                    add(filename, pdf)
+            done += len(reports)
+            progress(done, len(items))
+        if out_fmt == 'zip' and failed:
+            archive.writestr('errors.json', json.dumps(failed, indent=2))
+    finally:
+        if out_fmt == 'zip':
+            archive.close()
+    if out_fmt == 'pdf':
+        writer.write(out)
+    elapsed = time.perf_counter() - started
+    return {'reports': len(items) - len(failed), 'failed': failed, 'seconds': elapsed,
+            'reports_per_minute': 60 * len(items) / elapsed if elapsed else None}
+
+
+# ==============================================================================
+# BACKGROUND JOBS
+# ==============================================================================
+class BulkReportJobs(cache.JobStore):
+    """Bulk export jobs with progress, shared across workers through SQLite; outputs are kept in OUTPUT_DIR."""
+    SCHEMA = ['CREATE TABLE IF NOT EXISTS bulk_report_jobs (id TEXT PRIMARY KEY, status TEXT, done INTEGER, '
+              'total INTEGER, message TEXT, updated REAL, filename TEXT)']
+    TABLE, FIELDS = 'bulk_report_jobs', ['done', 'total']
+    TIMEOUT_MESSAGE = 'Bulk export timed out'
+
+    def _path(self, job_id, filename):
+        return os.path.join(OUTPUT_DIR, f"{job_id}_{filename}")
+
+    def submit(self, items, out_fmt='zip'):
+        """Start exporting `items` on a background thread and return the job id."""
+        job_id, now = uuid.uuid4().hex, time.time()
+        for old_id, filename in self._expire(now):
+            try:
+                os.remove(self._path(old_id, filename))
+            except FileNotFoundError:
+                pass
+        self._connection().execute("INSERT INTO bulk_report_jobs VALUES (?, 'running', 0, ?, 'Queued', ?, ?)",
+                                   (job_id, len(items), now, f"Feasibility_Reports.{out_fmt}"))
+        threading.Thread(target=self._run, args=(job_id, items, out_fmt), daemon=True).start()
+        return job_id
+
+    def _run(self, job_id, items, out_fmt):
+        path = self._path(job_id, f"Feasibility_Reports.{out_fmt}")
+        try:
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            with open(f"{path}.tmp", 'wb') as out:
+                summary = export(items, out, out_fmt, progress=lambda done, total: self._update(
+                    job_id, done=done, message=f"Rendered {done} of {total} reports"))
+            os.replace(f"{path}.tmp", path)
+            failed = f", {len(summary['failed'])} failed" if summary['failed'] else ''
+            self._update(job_id, status='done', message=f"{summary['reports']} reports ready{failed}")
+        except Exception as e:
+            self._update(job_id, status='failed', message=f"Bulk export failed: {e}")
+
+    def result(self, job_id):
+        """Return (filename, path) of a finished job's output, or None."""
+        row = self._connection().execute("SELECT filename FROM bulk_report_jobs WHERE id = ? AND status = 'done'",
+                                         (job_id,)).fetchone()
+        return (row[0], self._path(job_id, row[0])) if row else None
+
+
+jobs = BulkReportJobs()
+
+
+# ==============================================================================
+# FLASK ROUTES
+# ==============================================================================
+def register_routes(server):
+    """Register the bulk report routes on the Flask `server`.
+
+    POST /api/reports starts an export: send a sites file as multipart field
+    `file` (or as the raw body with `?format=csv|ndjson|parquet`), or JSON
+    `{"keys": [...]}` with cached result keys. Query options: `output=zip|pdf`,
+    `hourly=1`. Poll GET /api/reports/<id> for progress, then fetch
+    GET /api/reports/<id>/download.
+    """
+    from flask import jsonify, request, send_file
+
+    @server.route('/api/reports', methods=['POST'])
+    def start_bulk_reports():
+        out_fmt = request.args.get('output', 'zip')
+        try:
+            if request.is_json:
+                items = cached_items((request.get_json() or {}).get('keys', []))
+            else:
+                upload = request.files.get('file')
+                fmt = request.args.get('format') or batch.infer_format(upload.filename if upload else None)
+                with tempfile.TemporaryFile() as source:
+                    shutil.copyfileobj(upload.stream if upload else request.stream, source)
+                    source.seek(0)
+                    items = read_scenarios(source, fmt, request.args.get('hourly', '').lower() in ('1', 'true', 'yes'))
+            if out_fmt not in OUTPUT_FORMATS or not items:
+                raise ValueError(f"Send at least one site; output must be one of {OUTPUT_FORMATS}")
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'job_id': jobs.submit(items, out_fmt), 'total': len(items)}), 202
+
+    @server.route('/api/reports/<job_id>')
+    def bulk_report_status(job_id):
+        status = jobs.status(job_id)
+        return jsonify(status) if status else (jsonify({'error': 'Unknown job'}), 404)
+
+    @server.route('/api/reports/<job_id>/download')
+    def download_bulk_reports(job_id):
+        result = jobs.result(job_id)
+        if result is None:
+            return jsonify({'error': 'No finished export with this id'}), 404
+        filename, path = result
+        return send_file(path, as_attachment=True, download_name=filename)
+
+    return start_bulk_reports, bulk_report_status, download_bulk_reports
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a PDF feasibility report for every site of a portfolio.")
+    parser.add_argument('input', nargs='?', help="CSV, NDJSON or Parquet file of sites")
+    parser.add_argument('--keys', help="file of cached result keys, one per line, instead of a sites file")
+    parser.add_argument('-o', '--output', required=True, help="output .zip of PDFs or one merged .pdf")
+    parser.add_argument('--input-format', choices=batch.INPUT_FORMATS, help="defaults to the input file extension")
+    parser.add_argument('--hourly', action='store_true', help="use the hourly battery dispatch model")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="sites per worker task")
+    parser.add_argument('--workers', type=int, default=pool.WORKERS)
+    args = parser.parse_args(argv)
+    if bool(args.input) == bool(args.keys):
+        parser.error("give either a sites file or --keys")
+
+    if args.keys:
+        with open(args.keys, encoding='utf-8') as f:
+            items = cached_items([line.strip() for line in f if line.strip()])
+    else:
+        items = read_scenarios(args.input, args.input_format or batch.infer_format(args.input), args.hourly)
+    out_fmt = 'pdf' if args.output.lower().endswith('.pdf') else 'zip'
+    started = time.perf_counter()
+
+    def progress(done, total):
+        rate = 60 * done / (time.perf_counter() - started)
+        print(f"\rRendered {done}/{total} reports ({rate:.0f}/min)", end='', file=sys.stderr, flush=True)
+
+    with open(args.output, 'wb') as out:
+        summary = export(items, out, out_fmt, args.workers, args.batch_size, progress)
+    print(file=sys.stderr)
+    for failure in summary['failed']:
+        print(f"{failure['file']}: {failure['error']}", file=sys.stderr)
+    print(f"{summary['reports']} reports in {summary['seconds']:.1f} s ({summary['reports_per_minute']:.0f}/min) "
+          f"written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
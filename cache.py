@@ -0,0 +1,160 @@
+"""Server-side result cache.
+
+Results are stored in a local SQLite file keyed by a hash of the normalized
+inputs, so every gunicorn worker on the host shares hits. Entries expire
+after a TTL and the least recently used ones are evicted once the cache
+exceeds its entry or byte budget. Payloads are zlib-compressed JSON.
+"""
+import hashlib
+import json
+import numbers
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+# Bump when the model changes so stale results are not served.
+MODEL_VERSION = 3
+
+CACHE_PATH = os.environ.get('FEASIBILITY_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'feasibility_cache.sqlite'))
+MAX_ENTRIES = int(os.environ.get('FEASIBILITY_CACHE_MAX_ENTRIES', 5000))
+MAX_BYTES = int(os.environ.get('FEASIBILITY_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+TTL_SECONDS = int(os.environ.get('FEASIBILITY_CACHE_TTL', 7 * 24 * 3600))
+LABEL_KEYS = ('project_name',)   # inputs that name a result but do not change it
+JOB_TIMEOUT = 300        # seconds without progress before a job counts as failed
+JOB_RETENTION = 3600     # seconds finished jobs and their outputs are kept
+
+
+def _normalize(value):
+    # 12 significant digits absorb float noise such as 0.1 + 0.2 from the UI.
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, numbers.Real):
+        return float(f"{value:.12g}")
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return str(value)
+
+
+def make_key(inputs, namespace='results'):
+    """Stable hash of an input dict: equal inputs give equal keys regardless of key order or int/float type.
+
+    Labels in LABEL_KEYS do not change results, so they are left out: the same
+    scenario run under different project names shares one entry.
+    """
+    inputs = {name: value for name, value in inputs.items() if name not in LABEL_KEYS}
+    payload = json.dumps([namespace, MODEL_VERSION, _normalize(inputs)], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class SQLiteStore:
+    """Base for tables kept in the shared SQLite file; subclasses list their DDL in SCHEMA."""
+    SCHEMA = []
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread (and per process: the pid check covers forked workers).
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+
+class JobStore(SQLiteStore):
+    """Base for background job tables with an id, status, message, output filename and update time.
+
+    Subclasses name their TABLE, list its progress columns in FIELDS and its DDL in SCHEMA.
+    """
+    TABLE = None
+    FIELDS = []
+    TIMEOUT_MESSAGE = 'Job timed out'
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE {self.TABLE} SET {assignments}, updated = ? WHERE id = ?",
+                                   (*fields.values(), time.time(), job_id))
+
+    def _expire(self, now):
+        """Delete the jobs not updated for JOB_RETENTION seconds; returns their (id, filename) rows."""
+        conn = self._connection()
+        expired = conn.execute(f"SELECT id, filename FROM {self.TABLE} WHERE updated < ?", (now - JOB_RETENTION,)).fetchall()
+        conn.execute(f"DELETE FROM {self.TABLE} WHERE updated < ?", (now - JOB_RETENTION,))
+        return expired
+
+    def status(self, job_id):
+        """Return a dict with the status, the FIELDS and the message of `job_id` (None if unknown)."""
+        columns = ', '.join(['status', 'message', 'updated'] + self.FIELDS)
+        row = self._connection().execute(f"SELECT {columns} FROM {self.TABLE} WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, message, updated, *fields = row
+        if status in ('queued', 'running') and time.time() - updated > JOB_TIMEOUT:
+            status, message = 'failed', self.TIMEOUT_MESSAGE
+        return {'status': status, **dict(zip(self.FIELDS, fields)), 'message': message}
+
+
+class ResultCache(SQLiteStore):
+    """LRU + TTL cache of JSON-serializable values in a SQLite file."""
+    SCHEMA = ['CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, created REAL, accessed REAL, '
+              'size INTEGER, payload BLOB)',
+              'CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)']
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL_SECONDS):
+        super().__init__(path)
+        self.max_entries, self.max_bytes, self.ttl = max_entries, max_bytes, ttl
+
+    def get(self, key):
+        """Return the cached value for `key`, or None if it is missing or expired."""
+        if not key:
+            return None
+        conn, now = self._connection(), time.time()
+        row = conn.execute('SELECT payload FROM results WHERE key = ? AND created > ?', (key, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, value):
+        payload = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'), 6)
+        conn, now = self._connection(), time.time()
+        conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (key, now, now, len(payload), payload))
+        self._evict(conn, now)
+
+    def get_or_compute(self, inputs, compute, namespace='results'):
+        """Return (key, value) for `inputs`, calling `compute(inputs)` only on a miss."""
+        key = make_key(inputs, namespace)
+        value = self.get(key)
+        if value is None:
+            value = compute(inputs)
+            self.put(key, value)
+        return key, value
+
+    def _evict(self, conn, now):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM results WHERE created <= ?', (now - self.ttl,))
+            conn.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed DESC '
+                         'LIMIT -1 OFFSET ?)', (self.max_entries,))
+            conn.execute('DELETE FROM results WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER '
+                         '(ORDER BY accessed DESC) AS total FROM results) WHERE total > ?)', (self.max_bytes,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+results = ResultCache()
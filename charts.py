@@ -0,0 +1,44 @@
+"""Plotly figures of a result set.
+
+Results are kept as columns (dicts of lists, see `engine.result_set`). The
+same builders serve the dashboard and the PDF report, so reports are drawn
+from cached data rather than from figures sent back by the browser. Trace
+order is fixed so the dashboard can update figures in place with `Patch`.
+"""
+import plotly.graph_objects as go
+
+# Trace indices of the cash flow figure.
+REVENUE, OPEX, FREE_CASH_FLOW, FCF_P90, FCF_BAND, FCF_P50 = range(6)
+# Columns of the CO₂ table drawn as bars, in trace order.
+CO2_COLUMNS = ['Baseline Emissions (tons)', 'Project Emissions (tons)']
+
+
+def placeholder_layout(message):
+    return dict(template="plotly_white", annotations=[dict(text=message, showarrow=False)] if message else [])
+
+
+def cash_flow_figure(data=None, mc_data=None, message="No data yet. Please run a simulation."):
+    """Annual revenue, OPEX and free cash flow, with the Monte Carlo P10–P90 band and median when given."""
+    table = data['cash_flow_df'] if data else {}
+    years = table.get('Year', [])
+    bands = mc_data['cash_flow'] if mc_data else {}
+    mc_years = mc_data['years'] if mc_data else []
+    fig = go.Figure([
+        go.Bar(x=years, y=table.get('Revenue (€)', []), name='Revenue', marker_color='green'),
+        go.Bar(x=years, y=table.get('OPEX (€)', []), name='OPEX', marker_color='red'),
+        go.Scatter(x=years, y=table.get('Free Cash Flow (€)', []), name='Free Cash Flow', mode='lines+markers', line=dict(color='royalblue', width=3)),
+        go.Scatter(x=mc_years, y=bands.get('p90', []), name='FCF P90', mode='lines', line=dict(width=0), showlegend=False, visible=bool(mc_data)),
+        go.Scatter(x=mc_years, y=bands.get('p10', []), name='FCF P10–P90', mode='lines', line=dict(width=0), fill='tonexty', fillcolor='rgba(65,105,225,0.2)', visible=bool(mc_data)),
+        go.Scatter(x=mc_years, y=bands.get('p50', []), name='FCF P50', mode='lines', line=dict(color='royalblue', dash='dash'), visible=bool(mc_data)),
+    ])
+    fig.update_layout(title_text="Annual Financial Performance", barmode='group', **placeholder_layout(None if data else message))
+    return fig
+
+
+def co2_figure(data=None, message="No data yet. Please run a simulation."):
+    """Annual grid-only baseline vs. project emissions."""
+    table = data['co2_df'] if data else {}
+    fig = go.Figure([go.Bar(x=table.get('Year', []), y=table.get(column, []), name=column) for column in CO2_COLUMNS])
+    fig.update_layout(title_text='Annual CO₂ Emissions: Baseline vs. Project', barmode='group', xaxis_title='Year',
+                      yaxis_title='CO₂ Emissions (tons)', legend_title_text='variable', **placeholder_layout(None if data else message))
+    return fig
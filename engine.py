@@ -0,0 +1,309 @@
+"""Vectorized feasibility model.
+
+Every function here works on a batch of N scenarios at once. Scenario inputs
+are 1-D arrays of shape (N,) (scalars are broadcast), yearly quantities are
+2-D arrays of shape (N, Y) where Y is the longest simulation horizon in the
+batch. Years past a scenario's own horizon are masked to zero, so scenarios
+with different `sim_years` can share one batch.
+"""
+import numpy as np
+
+import dispatch
+
+# ==============================================================================
+# MODEL CONSTANTS
+# ==============================================================================
+AVG_GEN_PER_KWP = 1100          # kWh per kWp in year 1
+PV_DEGRADATION = 0.005          # yearly loss of PV output
+SELF_CONSUMPTION_RATIO = 0.4    # share of PV generation used on site
+
+# Dash component id, model key, and whether the UI value is given in percent.
+# The order is the order in which the master callback reads its States.
+INPUT_FIELDS = [
+    ('project-name', 'project_name', False),
+    ('simulation-years', 'sim_years', False),
+    ('pv-size', 'pv_size', False),
+    ('battery-size', 'battery_size', False),
+    ('ev-demand', 'ev_demand', False),
+    ('pv-cost', 'pv_cost', False),
+    ('battery-cost', 'battery_cost', False),
+    ('infra-cost', 'infra_cost', False),
+    ('om-cost-pct', 'om_pct', True),
+    ('grid-price', 'grid_price', False),
+    ('feed-in-tariff', 'feed_in_tariff', False),
+    ('inflation-pct', 'inflation', True),
+    ('loan-coverage-pct', 'loan_coverage', True),
+    ('interest-rate-pct', 'interest_rate', True),
+    ('depreciation-pct', 'depreciation_rate', True),
+    ('tax-rate-pct', 'tax_rate', True),
+    ('grid-co2-intensity', 'grid_co2_kg', False),
+    ('co2-price', 'co2_price', False),
+]
+FIELD_IDS = [field_id for field_id, _, _ in INPUT_FIELDS]
+MODEL_KEYS = [key for _, key, _ in INPUT_FIELDS if key != 'project_name']
+# Inputs without a UI field, with the default used when they are not given.
+OPTIONAL_KEYS = {'pv_yield': AVG_GEN_PER_KWP}
+# Optional measured hourly shapes (8760,) shared by all scenarios of a batch, used by
+# the hourly dispatch instead of its synthetic profiles (see profiles.py).
+SHAPE_KEYS = ('pv_shape', 'load_shape')
+
+
+def parse_inputs(values):
+    """Map raw UI values (in INPUT_FIELDS order) to the model's input dict."""
+    return {key: (value / 100 if is_pct else value)
+            for (_, key, is_pct), value in zip(INPUT_FIELDS, values)}
+
+
+def _as_batch(inputs):
+    """Broadcast the numeric model inputs to float arrays of a common shape (N,); shapes are passed through."""
+    keys = MODEL_KEYS + list(OPTIONAL_KEYS)
+    values = [inputs[key] for key in MODEL_KEYS] + [inputs.get(key, default) for key, default in OPTIONAL_KEYS.items()]
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(value, dtype=float)) for value in values])
+    return {**dict(zip(keys, arrays)), **{key: inputs.get(key) for key in SHAPE_KEYS}}
+
+
+# ==============================================================================
+# MODEL STAGES
+# ==============================================================================
+def horizon(sim_years):
+    """Return the year axis (Y,) and the (N, Y) mask of years inside each scenario's horizon."""
+    sim_years = np.asarray(sim_years).astype(int)
+    years = np.arange(1, sim_years.max() + 1)
+    return years, years[None, :] <= sim_years[:, None]
+
+
+def generation(pv_size, pv_yield, years, mask):
+    degradation = (1 - PV_DEGRADATION) ** (years - 1)
+    return (pv_size * pv_yield)[:, None] * degradation * mask
+
+
+def energy_flows(pv_generation, ev_demand, mask):
+    self_consumed = pv_generation * SELF_CONSUMPTION_RATIO
+    grid_import = np.maximum(0, ev_demand[:, None] - self_consumed) * mask
+    grid_export = pv_generation - self_consumed
+    return {'self_consumed': self_consumed, 'grid_import': grid_import, 'grid_export': grid_export}
+
+
+def capex(pv_size, pv_cost, battery_size, battery_cost, infra_cost):
+    return pv_size * pv_cost + battery_size * battery_cost + infra_cost
+
+
+def opex_revenue(p, flows, capex_total, years, mask):
+    inflation_factor = (1 + p['inflation'][:, None]) ** (years - 1) * mask
+    opex_om = (capex_total * p['om_pct'])[:, None] * inflation_factor
+    opex_grid_cost = flows['grid_import'] * p['grid_price'][:, None] * inflation_factor
+    revenue_feed_in = flows['grid_export'] * p['feed_in_tariff'][:, None] * inflation_factor
+    co2_saved_tons = flows['self_consumed'] * p['grid_co2_kg'][:, None] / 1000
+    revenue_co2 = co2_saved_tons * p['co2_price'][:, None] * inflation_factor
+    return {'total_opex': opex_om + opex_grid_cost, 'total_revenue': revenue_feed_in + revenue_co2}
+
+
+def profit_and_loss(p, total_revenue, total_opex, capex_total, mask):
+    annual_depreciation = capex_total * p['depreciation_rate']
+    interest_payment = capex_total * p['loan_coverage'] * p['interest_rate']
+    ebitda = total_revenue - total_opex
+    ebit = ebitda - annual_depreciation[:, None] * mask
+    ebt = ebit - interest_payment[:, None] * mask
+    tax_on_ebt = np.maximum(0, ebt * p['tax_rate'][:, None])
+    return {'ebitda': ebitda, 'ebit': ebit, 'annual_depreciation': annual_depreciation,
+            'net_income': ebt - tax_on_ebt}
+
+
+def cash_flow(ebit, annual_depreciation, tax_rate, capex_total, mask):
+    """Free cash flow of shape (N, Y + 1); column 0 is the year-0 investment."""
+    operating = (ebit * (1 - tax_rate[:, None]) + annual_depreciation[:, None]) * mask
+    return np.concatenate([-capex_total[:, None], operating], axis=1)
+
+
+def npv(rate, cash_flows):
+    """Batched equivalent of `npf.npv`: cash_flows[:, 0] is undiscounted."""
+    t = np.arange(cash_flows.shape[1])
+    return (cash_flows * (1 + np.asarray(rate, dtype=float).reshape(-1, 1)) ** -t).sum(axis=1)
+
+
+# Rates are bracketed on a grid in u = ln(1 + r) spanning r from -99.9999 % to
+# ~1000 %, densest around 0 where realistic IRRs sit.
+_IRR_GRID = np.concatenate([np.linspace(-13.8, -1, 16, endpoint=False),
+                            np.linspace(-1, 1, 80, endpoint=False),
+                            np.linspace(1, 6.9, 12)])
+_IRR_CHUNK = 8192
+
+
+def _polyval(cash_flows, x):
+    """Evaluate sum(c_t * x**t) and its derivative row-wise by Horner's rule."""
+    value, slope = cash_flows[:, -1].copy(), np.zeros(len(x))
+    for column in cash_flows.T[-2::-1]:
+        slope = slope * x + value
+        value = value * x + column
+    return value, slope
+
+
+def _refine_irr(cash_flows, values, bracket, tol, max_iter):
+    """Solve for the root inside grid cell `bracket` of each row by safeguarded Newton in x = 1 / (1 + r)."""
+    rows = np.arange(len(cash_flows))
+    # In x, the bracket is [x_lo, x_hi] with x_lo belonging to the higher rate.
+    x_lo, x_hi = np.exp(-_IRR_GRID[bracket + 1]), np.exp(-_IRR_GRID[bracket])
+    f_lo = values[rows, bracket + 1]
+    x = (x_lo + x_hi) / 2
+    active = np.ones(len(rows), dtype=bool)
+    for _ in range(max_iter):
+        f, df = _polyval(cash_flows[active], x[active])
+        same = np.sign(f) * np.sign(f_lo[active]) > 0
+        lo, hi = np.where(same, x[active], x_lo[active]), np.where(same, x_hi[active], x[active])
+        x_lo[active], x_hi[active] = lo, hi
+        f_lo[active] = np.where(same, f, f_lo[active])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = x[active] - f / df
+        step = np.where((step > lo) & (step < hi), step, (lo + hi) / 2)
+        converged = (np.abs(step - x[active]) <= tol * step) | (f == 0)
+        x[active] = np.where(f == 0, x[active], step)
+        active[np.flatnonzero(active)[converged]] = False
+        if not active.any():
+            break
+    return 1 / x - 1
+
+
+def irr(cash_flows, tol=1e-12, max_iter=100):
+    """Batched IRR for each row of `cash_flows`, as a fraction.
+
+    Matches `npf.irr`: among all rates r > -1 with NPV(r) = 0 the one closest
+    to zero is returned, NaN where there is none. Instead of polynomial roots
+    per row, NPV is evaluated on a fixed rate grid with one matrix product.
+    The sign changes nearest to r = 0 from below and from above bracket the
+    candidate roots, which are refined for all rows together. Distinct roots
+    closer together than the grid spacing (2.5 % around zero) can be missed.
+    """
+    cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+    if len(cash_flows) > _IRR_CHUNK:
+        return np.concatenate([irr(cash_flows[i:i + _IRR_CHUNK], tol, max_iter)
+                               for i in range(0, len(cash_flows), _IRR_CHUNK)])
+    t = np.arange(cash_flows.shape[1])
+    values = cash_flows @ np.exp(-np.outer(t, _IRR_GRID))
+    crosses = (np.sign(values[:, :-1]) * np.sign(values[:, 1:])) <= 0
+    crosses &= (cash_flows != 0).any(axis=1)[:, None]   # an all-zero row is zero everywhere, not a root
+    candidates = []
+    for side in (_IRR_GRID[1:] <= 0, _IRR_GRID[:-1] >= 0):
+        # Cells are ordered by rate, so the nearest crossing is the last one
+        # below zero and the first one above zero.
+        hits = crosses & side
+        first = hits.argmax(axis=1)
+        last = hits.shape[1] - 1 - hits[:, ::-1].argmax(axis=1)
+        bracket = last if side[0] else first
+        has_root = hits.any(axis=1)
+        rate = np.full(len(cash_flows), np.nan)
+        rate[has_root] = _refine_irr(cash_flows[has_root], values[has_root], bracket[has_root], tol, max_iter)
+        candidates.append(rate)
+    below, above = candidates
+    return np.where(np.isnan(below) | (np.abs(above) < np.abs(below)), above, below)
+
+
+def payback(cash_flows):
+    """Index of the first year with positive cumulative cash flow, -1 if never reached."""
+    positive = np.cumsum(cash_flows, axis=1) > 0
+    return np.where(positive.any(axis=1), positive.argmax(axis=1), -1)
+
+
+# ==============================================================================
+# STAGE GRAPH
+# ==============================================================================
+FLOW_KEYS = ('self_consumed', 'grid_import', 'grid_export')
+
+
+def _flows_stage(p, s):
+    if p.get('hourly'):
+        return dispatch.simulate(s['pv_generation'], p['ev_demand'], p['battery_size'], s['mask'], p['pv_shape'], p['load_shape'])
+    return energy_flows(s['pv_generation'], p['ev_demand'], s['mask'])
+
+
+def _pnl_stage(p, s):
+    return profit_and_loss(p, s['total_revenue'], s['total_opex'], s['capex_total'], s['mask'])
+
+
+def _cash_flow_stage(p, s):
+    return {'free_cash_flow': cash_flow(s['ebit'], s['annual_depreciation'], p['tax_rate'], s['capex_total'], s['mask'])}
+
+
+def _kpi_stage(p, s):
+    return {'npv': npv(p['interest_rate'], s['free_cash_flow']), 'irr': irr(s['free_cash_flow']),
+            'payback': payback(s['free_cash_flow'])}
+
+
+def _emissions_stage(p, s):
+    baseline_co2 = (p['ev_demand'] * p['grid_co2_kg'] / 1000)[:, None] * s['mask']
+    project_co2 = s['grid_import'] * p['grid_co2_kg'][:, None] / 1000
+    return {'baseline_co2': baseline_co2, 'project_co2': project_co2, 'co2_saved': baseline_co2 - project_co2}
+
+
+# Named stages in dependency order: (name, model inputs read, upstream stages, function).
+# A function takes the batch inputs and the outputs of the stages before it, and
+# returns a dict of its own outputs. 'hourly' is the energy model switch.
+STAGES = [
+    ('horizon', ['sim_years'], [], lambda p, s: dict(zip(('years', 'mask'), horizon(p['sim_years'])))),
+    ('generation', ['pv_size', 'pv_yield'], ['horizon'],
+     lambda p, s: {'pv_generation': generation(p['pv_size'], p['pv_yield'], s['years'], s['mask'])}),
+    ('energy_flows', ['ev_demand', 'battery_size', 'hourly', 'pv_shape', 'load_shape'], ['horizon', 'generation'], _flows_stage),
+    ('capex', ['pv_size', 'pv_cost', 'battery_size', 'battery_cost', 'infra_cost'], [],
+     lambda p, s: {'capex_total': capex(p['pv_size'], p['pv_cost'], p['battery_size'], p['battery_cost'], p['infra_cost'])}),
+    ('opex_revenue', ['om_pct', 'grid_price', 'feed_in_tariff', 'inflation', 'grid_co2_kg', 'co2_price'],
+     ['horizon', 'energy_flows', 'capex'], lambda p, s: opex_revenue(p, s, s['capex_total'], s['years'], s['mask'])),
+    ('profit_and_loss', ['depreciation_rate', 'loan_coverage', 'interest_rate', 'tax_rate'],
+     ['horizon', 'capex', 'opex_revenue'], _pnl_stage),
+    ('cash_flow', ['tax_rate'], ['horizon', 'capex', 'profit_and_loss'], _cash_flow_stage),
+    ('kpis', ['interest_rate'], ['cash_flow'], _kpi_stage),
+    ('emissions', ['ev_demand', 'grid_co2_kg'], ['horizon', 'energy_flows'], _emissions_stage),
+]
+
+
+def run_stages(p, values, stages=None):
+    """Run the named `stages` (all by default) in dependency order, adding their outputs to `values`."""
+    for name, _, _, compute in STAGES:
+        if stages is None or name in stages:
+            values.update(compute(p, values))
+    return values
+
+
+# ==============================================================================
+# BATCH EVALUATION
+# ==============================================================================
+def evaluate_batch(inputs, hourly=False, flows=None):
+    """Run the full model for every scenario in `inputs`.
+
+    `inputs` maps the keys in MODEL_KEYS (and optionally OPTIONAL_KEYS) to
+    scalars or arrays of shape (N,), already in model units (fractions, not
+    percent). With `hourly=True` the energy flows come from the 8760-step
+    battery dispatch instead of the fixed self-consumption ratio. Callers that
+    already know the (N, Y) energy flows can pass them as `flows` to skip that
+    stage. Returns a dict of arrays.
+    """
+    p = _as_batch(inputs)
+    p['hourly'] = hourly
+    if flows is None:
+        return run_stages(p, {})
+    values = run_stages(p, {}, ['horizon', 'generation'])
+    values.update({key: flows[key] * values['mask'] for key in FLOW_KEYS})
+    return run_stages(p, values, [name for name, _, _, _ in STAGES if name not in ('horizon', 'generation', 'energy_flows')])
+
+
+# ==============================================================================
+# RESULT SETS
+# ==============================================================================
+def result_set(inputs, result, index=0):
+    """Format scenario `index` of a model result for the dashboard, cache and report.
+
+    Tables are kept column-wise (dicts of lists): each column name appears
+    once instead of once per row.
+    """
+    n = int(result['mask'][index].sum())   # this scenario's horizon; a batch is padded to the longest
+    row = lambda key: np.broadcast_to(result[key][index], result['years'].shape)[:n].tolist()
+    years, free_cash_flow = result['years'][:n].tolist(), result['free_cash_flow'][index][:n + 1].tolist()
+    npv, irr, payback_year = result['npv'][index], result['irr'][index] * 100, result['payback'][index]
+    if payback_year < 0: payback_year = "N/A"
+    cash_flow = {'Year': years, 'Revenue (€)': row('total_revenue'), 'OPEX (€)': row('total_opex'),
+                 'EBITDA (€)': row('ebitda'), 'Depreciation (€)': row('annual_depreciation'),
+                 'Net Income (€)': row('net_income'), 'Free Cash Flow (€)': free_cash_flow[1:]}
+    baseline, project = row('baseline_co2'), row('project_co2')
+    co2 = {'Year': years, 'Baseline Emissions (tons)': baseline, 'Project Emissions (tons)': project,
+           'CO₂ Saved (tons)': [b - p for b, p in zip(baseline, project)]}
+    return {'inputs': inputs, 'kpis': {'npv': f"€ {npv:,.0f}", 'irr': f"{irr:.2f} %", 'payback': f"Year {payback_year}",
+        'co2_saved': f"{sum(co2['CO₂ Saved (tons)']):,.0f} tons"}, 'cash_flow_df': cash_flow, 'co2_df': co2,
+        'free_cash_flow_data': free_cash_flow}
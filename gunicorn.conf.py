@@ -0,0 +1,38 @@
+"""Gunicorn settings, picked up automatically by `gunicorn app:server`.
+
+The app is built once in the master (`preload_app`) together with the modules
+it otherwise imports on first use, then workers are forked from it and share
+those pages copy-on-write. `gc.freeze()` keeps the workers' garbage collector
+from touching, and so copying, the preloaded objects. /metrics on each worker
+reports its RSS and its private (uss) and proportional (pss) shares.
+
+A browser does not survive a fork, so each worker starts its own kaleido
+browser right after it is forked, in the background; the first PDF export
+then does not pay the Chrome startup.
+"""
+import gc
+import os
+import threading
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8050)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = True
+
+
+def when_ready(server):
+    import app
+    app.preload()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import report
+
+    def warm():
+        try:
+            report.warm_renderer()
+        except Exception as e:
+            server.log.warning("Chart renderer not started, the first PDF export starts it: %s", e)
+
+    threading.Thread(target=warm, name='warm-renderer', daemon=True).start()
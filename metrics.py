@@ -0,0 +1,148 @@
+"""Runtime latency and payload metrics.
+
+Every request to the Flask server is timed; Dash callback requests are
+labelled with the callback's function name, other routes with their
+endpoint. Latency and response-size histograms are exposed in Prometheus
+text format on GET /metrics, and each response carries a `Server-Timing`
+header with its total time and the phases timed with `timed()` while it was
+being handled, so browser dev tools show where a callback spends its time.
+
+Metrics are kept per process: with several gunicorn workers, each scrape
+sees the worker that answered it (the `pid` label tells them apart). Each
+worker also reports its memory (RSS, and on Linux the proportional and
+private shares, which show how much of it is shared copy-on-write with the
+preloading master) and how long building the app took.
+"""
+import contextlib
+import os
+import sys
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DASH_UPDATE_PATH = '/_dash-update-component'
+
+# (metric name, help text, buckets)
+METRICS = {
+    'latency': ('feasibility_request_seconds', 'Server-side request latency in seconds', LATENCY_BUCKETS),
+    'size': ('feasibility_response_bytes', 'Response body size in bytes', SIZE_BUCKETS),
+    'phase': ('feasibility_phase_seconds', 'Time spent in a named phase in seconds', LATENCY_BUCKETS),
+}
+
+_lock = threading.Lock()
+_histograms = {}   # (metric, label) -> [bucket counts..., +Inf count], sum
+_local = threading.local()
+_startup = {}
+
+
+def observe(metric, label, value):
+    """Add `value` to the histogram of `metric` ('latency', 'size' or 'phase') for `label`."""
+    buckets = METRICS[metric][2]
+    with _lock:
+        counts, total = _histograms.get((metric, label), ([0] * (len(buckets) + 1), 0))
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        _histograms[(metric, label)] = (counts, total + value)
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """Time a block as `phase`: recorded in the phase histogram and in the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('phase', phase, elapsed)
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((phase, elapsed))
+
+
+def record_startup(create_app_seconds):
+    """Remember how long building the app took, reported as a gauge."""
+    _startup['create_app_seconds'] = create_app_seconds
+
+
+def process_memory():
+    """Memory of this process in bytes: 'rss', 'pss' and 'uss' (private) from /proc, else the peak 'max_rss'."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in f if line.split()[-1:] == ['kB']}
+        return {'rss': fields['Rss'], 'pss': fields['Pss'],
+                'uss': fields['Private_Clean'] + fields['Private_Dirty']}
+    except (OSError, KeyError):
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024   # ru_maxrss is in bytes on macOS, KiB elsewhere
+        return {'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale}
+
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    lines, pid = [], os.getpid()
+    with _lock:
+        snapshot = sorted(_histograms.items())
+    for metric, (name, help_text, buckets) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        label_name = 'phase' if metric == 'phase' else 'handler'
+        for (kind, label), (counts, total) in snapshot:
+            if kind != metric:
+                continue
+            labels = f'{label_name}="{label}",pid="{pid}"'
+            for bound, count in zip(buckets, counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {counts[-1]}')
+            lines.append(f'{name}_sum{{{labels}}} {total:.6g}')
+            lines.append(f'{name}_count{{{labels}}} {counts[-1]}')
+    lines += ["# HELP feasibility_process_memory_bytes Memory of this worker process in bytes",
+              "# TYPE feasibility_process_memory_bytes gauge"]
+    lines += [f'feasibility_process_memory_bytes{{kind="{kind}",pid="{pid}"}} {value}' for kind, value in process_memory().items()]
+    if 'create_app_seconds' in _startup:
+        lines += ["# HELP feasibility_create_app_seconds Time spent building the Dash app in seconds",
+                  "# TYPE feasibility_create_app_seconds gauge",
+                  f'feasibility_create_app_seconds{{pid="{pid}"}} {_startup["create_app_seconds"]:.6g}']
+    return '\n'.join(lines) + '\n'
+
+
+def _handler_name(app, request):
+    # Dash routes every callback through one endpoint; the request names the outputs it updates.
+    if request.path.endswith(DASH_UPDATE_PATH) and app is not None:
+        output = (request.get_json(silent=True) or {}).get('output')
+        callback = app.callback_map.get(output, {}).get('callback')
+        return getattr(callback, '__name__', 'unknown_callback')
+    return request.endpoint or 'not_found'
+
+
+def register_routes(server, app=None):
+    """Time every request on the Flask `server` and serve GET /metrics.
+
+    Pass the Dash `app` so callback requests are labelled by callback name.
+    """
+    from flask import Response, request
+
+    @server.before_request
+    def start_timer():
+        _local.start, _local.timings = time.perf_counter(), []
+
+    @server.after_request
+    def record(response):
+        start = getattr(_local, 'start', None)
+        if start is None or request.endpoint == 'metrics':
+            return response
+        elapsed, handler = time.perf_counter() - start, _handler_name(app, request)
+        observe('latency', handler, elapsed)
+        if not response.is_streamed:
+            observe('size', handler, response.calculate_content_length() or 0)
+        timings = [f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in _local.timings]
+        response.headers['Server-Timing'] = ', '.join([f'total;dur={elapsed * 1000:.1f};desc="{handler}"'] + timings)
+        _local.start, _local.timings = None, None
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
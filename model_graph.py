@@ -0,0 +1,85 @@
+"""Incremental model evaluation.
+
+`ModelGraph` keeps the inputs and the intermediate arrays of every stage in
+`engine.STAGES` from its last evaluation. When inputs change, only the stages
+that read a changed input, and the stages downstream of them, are re-run:
+changing the CO₂ price re-runs opex/revenue, P&L, cash flow and KPIs, but not
+the PV generation, energy flows (or hourly dispatch) and CAPEX. This keeps
+live updates and one-at-a-time sensitivity runs cheap.
+"""
+import threading
+
+import numpy as np
+
+import engine
+
+SENSITIVITY_SWING = 0.1
+
+
+class ModelGraph:
+    """Stage graph holding the intermediate results of the last evaluated scenario batch.
+
+    One instance is shared by all callbacks of a worker; a lock serializes
+    evaluations, so concurrent sessions stay correct but evict each other's
+    intermediates.
+    """
+
+    def __init__(self):
+        self._inputs = None
+        self._values = {}
+        self._lock = threading.Lock()
+        self.last_run = []   # stages re-run by the last committed evaluation
+
+    @staticmethod
+    def _dirty(changed):
+        dirty = []
+        for name, keys, upstream, _ in engine.STAGES:
+            if changed.intersection(keys) or any(stage in dirty for stage in upstream):
+                dirty.append(name)
+        return dirty
+
+    def _changed(self, p):
+        if self._inputs is None or np.shape(p['sim_years']) != np.shape(self._inputs['sim_years']):
+            return set(p)
+        return {key for key, value in p.items() if not np.array_equal(value, self._inputs[key])}
+
+    def evaluate(self, inputs, hourly=False, commit=True):
+        """Evaluate `inputs` (as for `engine.evaluate_batch`), re-running only the affected stages.
+
+        With `commit=False` the stored state is left untouched, so a
+        perturbed scenario can be evaluated against the current one.
+        Returns the dict of all stage outputs.
+        """
+        p = engine._as_batch(inputs)
+        p['hourly'] = bool(hourly)
+        with self._lock:
+            stages = self._dirty(self._changed(p))
+            values = engine.run_stages(p, dict(self._values), stages)
+            if commit:
+                self._inputs, self._values, self.last_run = p, values, stages
+        return values
+
+    def sensitivity(self, inputs, hourly=False, swing=SENSITIVITY_SWING, metric='npv'):
+        """One-at-a-time sensitivity of `metric` to every numeric input, for a tornado chart.
+
+        Each key in MODEL_KEYS is moved by -/+ `swing` (relative) while the
+        others stay at their base value; the simulation horizon moves by at
+        least one year. Returns the base value and a list of dicts with the
+        key, the perturbed input values and the resulting metric values,
+        sorted by descending impact. IRR is reported in percent.
+        """
+        scale = 100 if metric == 'irr' else 1
+        base = float(self.evaluate(inputs, hourly)[metric][0]) * scale
+        rows = []
+        for key in engine.MODEL_KEYS:
+            value = float(inputs[key])
+            if key == 'sim_years':
+                step = max(1, round(value * swing))
+                low_input, high_input = max(1, value - step), value + step
+            else:
+                low_input, high_input = value * (1 - swing), value * (1 + swing)
+            low, high = (float(self.evaluate({**inputs, key: x}, hourly, commit=False)[metric][0]) * scale
+                         for x in (low_input, high_input))
+            rows.append({'key': key, 'low_input': low_input, 'high_input': high_input, 'low': low, 'high': high})
+        rows.sort(key=lambda row: -np.nan_to_num(abs(row['high'] - row['low']), nan=-1))
+        return base, rows
@@ -0,0 +1,226 @@
+"""Monte Carlo uncertainty analysis.
+
+Draws are generated and evaluated in fixed-size chunks, each with its own
+child seed spawned from the run's seed, so results depend only on the seed
+and draw count, not on the number of workers. Every chunk is reduced to
+small quantile sketches before it leaves its worker and the sketches are
+merged in chunk order, which keeps memory bounded for any draw count.
+"""
+import numpy as np
+
+import dispatch
+import engine
+import pool
+
+# Uncertain quantity -> model inputs it scales.
+UNCERTAIN_INPUTS = {
+    'grid_price': ['grid_price'],
+    'feed_in_tariff': ['feed_in_tariff'],
+    'inflation': ['inflation'],
+    'co2_price': ['co2_price'],
+    'capex': ['pv_cost', 'battery_cost', 'infra_cost'],
+    'pv_yield': ['pv_yield'],
+}
+DISTRIBUTIONS = ['normal', 'uniform', 'triangular']
+CHUNK_SIZE = 20000
+SKETCH_SIZE = 512
+HISTOGRAM_BINS = 40
+# Number of PV yield multipliers at which the hourly dispatch is simulated;
+# flows for each draw are interpolated between them.
+YIELD_NODES = 17
+
+
+# ==============================================================================
+# STREAMING QUANTILE SKETCH
+# ==============================================================================
+class QuantileSketch:
+    """Mergeable quantile summary holding at most `size` weighted centroids.
+
+    Values are kept exactly until the sketch overflows, then neighbouring
+    values are collapsed into centroids of roughly equal weight. Values that
+    are not finite (draws without an IRR) are only counted and rank below
+    every other value, as -inf.
+    """
+
+    def __init__(self, size=SKETCH_SIZE):
+        self.size = size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.undefined = 0
+
+    @property
+    def count(self):
+        return self.undefined + self.weights.sum()
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        finite = np.isfinite(values)
+        self.undefined += int((~finite).sum())
+        return self._absorb(values[finite], np.ones(finite.sum()))
+
+    def merge(self, other):
+        self.undefined += other.undefined
+        return self._absorb(other.means, other.weights)
+
+    def _absorb(self, means, weights):
+        means, weights = np.concatenate([self.means, means]), np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        if len(means) > self.size:
+            cumulative = np.cumsum(weights) - weights
+            group = np.minimum((cumulative / weights.sum() * self.size).astype(int), self.size - 1)
+            totals = np.bincount(group, weights=weights)
+            keep = totals > 0
+            means = (np.bincount(group, weights=means * weights)[keep] / totals[keep])
+            weights = totals[keep]
+        self.means, self.weights = means, weights
+        return self
+
+    def quantile(self, q):
+        """Quantiles over all counted values; -inf where they fall among the undefined ones."""
+        q = np.asarray(q, dtype=float)
+        if not self.count:
+            return np.full(q.shape, np.nan)
+        rank = q * self.count - self.undefined
+        if not len(self.means):
+            return np.full(q.shape, -np.inf)
+        positions = np.cumsum(self.weights) - self.weights / 2
+        return np.where(rank < 0, -np.inf, np.interp(rank, positions, self.means))
+
+    def histogram(self, bins=HISTOGRAM_BINS):
+        """Approximate histogram (bin centers, counts) from the centroids."""
+        if not len(self.means):
+            return [], []
+        counts, edges = np.histogram(self.means, bins=bins, weights=self.weights)
+        return ((edges[:-1] + edges[1:]) / 2).tolist(), counts.tolist()
+
+
+# ==============================================================================
+# SAMPLING AND CHUNK EVALUATION
+# ==============================================================================
+def sample_multipliers(spec, n, rng):
+    """Draw `n` multipliers for each uncertain quantity in `spec`.
+
+    `spec` maps names in UNCERTAIN_INPUTS to {'dist': ..., 'spread': ...} where
+    `spread` is relative to the base value: one standard deviation for
+    'normal', the half-width for 'uniform' and 'triangular'.
+    """
+    multipliers = {}
+    for name in UNCERTAIN_INPUTS:
+        dist, spread = spec.get(name, {}).get('dist', 'normal'), spec.get(name, {}).get('spread', 0)
+        if dist not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution '{dist}', expected one of {DISTRIBUTIONS}")
+        if dist == 'normal':
+            draw = rng.normal(1, spread, n)
+        elif dist == 'uniform':
+            draw = rng.uniform(1 - spread, 1 + spread, n)
+        else:
+            draw = rng.triangular(1 - spread, 1, 1 + spread, n) if spread else np.ones(n)
+        multipliers[name] = np.maximum(draw, 0)
+    return multipliers
+
+
+def yield_nodes(spec):
+    """Evenly spaced PV yield multipliers covering the range drawn under `spec`."""
+    dist, spread = spec.get('pv_yield', {}).get('dist', 'normal'), spec.get('pv_yield', {}).get('spread', 0)
+    if not spread:
+        return np.ones(1)
+    width = 5 * spread if dist == 'normal' else spread
+    return np.linspace(max(1 - width, 0), 1 + width, YIELD_NODES)
+
+
+def dispatch_at_yields(base, nodes):
+    """Hourly dispatch flows (K, Y) of the base scenario at each PV yield multiplier in `nodes`."""
+    batch = engine._as_batch({**base, 'pv_yield': base.get('pv_yield', engine.AVG_GEN_PER_KWP) * nodes})
+    years, mask = engine.horizon(batch['sim_years'])
+    pv_generation = engine.generation(batch['pv_size'], batch['pv_yield'], years, mask)
+    return dispatch.simulate(pv_generation, batch['ev_demand'], batch['battery_size'], mask, batch['pv_shape'], batch['load_shape'])
+
+
+def _interpolate_flows(nodes, node_flows, multiplier):
+    """Linearly interpolate the (K, Y) node flows to (N, Y) flows at the drawn yield multipliers."""
+    if len(nodes) == 1:
+        return {key: np.repeat(values, len(multiplier), axis=0) for key, values in node_flows.items()}
+    position = np.clip((multiplier - nodes[0]) / (nodes[1] - nodes[0]), 0, len(nodes) - 1)
+    left = np.minimum(position.astype(int), len(nodes) - 2)
+    weight = (position - left)[:, None]
+    return {key: (1 - weight) * values[left] + weight * values[left + 1] for key, values in node_flows.items()}
+
+
+def run_chunk(base, spec, n, seed, nodes=None, node_flows=None):
+    """Evaluate `n` draws and reduce them to sketches.
+
+    Returns a dict with sketches for NPV, IRR (in percent) and the annual free
+    cash flow of every year, plus the number of draws with a positive NPV.
+    """
+    multipliers = sample_multipliers(spec, n, np.random.default_rng(seed))
+    inputs = {key: base[key] for key in engine.MODEL_KEYS}
+    inputs['pv_yield'] = base.get('pv_yield', engine.AVG_GEN_PER_KWP)
+    for name, keys in UNCERTAIN_INPUTS.items():
+        for key in keys:
+            inputs[key] = inputs[key] * multipliers[name]
+    flows = None if node_flows is None else _interpolate_flows(nodes, node_flows, multipliers['pv_yield'])
+    result = engine.evaluate_batch(inputs, flows=flows)
+    free_cash_flow = result['free_cash_flow']
+    return {
+        'npv': QuantileSketch().add(result['npv']),
+        'irr': QuantileSketch().add(result['irr'] * 100),
+        'cash_flow': [QuantileSketch().add(column) for column in free_cash_flow.T[1:]],
+        'npv_positive': int((result['npv'] > 0).sum()),
+        'draws': n,
+    }
+
+
+def _merge(total, part):
+    if total is None:
+        return part
+    total['npv'].merge(part['npv'])
+    total['irr'].merge(part['irr'])
+    for sketch, other in zip(total['cash_flow'], part['cash_flow']):
+        sketch.merge(other)
+    total['npv_positive'] += part['npv_positive']
+    total['draws'] += part['draws']
+    return total
+
+
+# ==============================================================================
+# PUBLIC ENTRY POINT
+# ==============================================================================
+def run(base, spec, draws, seed=0, hourly=False, chunk_size=CHUNK_SIZE):
+    """Run `draws` Monte Carlo draws around the `base` model inputs.
+
+    Returns a JSON-serializable summary: P10/P50/P90 of NPV, IRR and each
+    year's free cash flow, histograms of NPV and IRR, the probability of a
+    positive NPV and the share of draws without an IRR. Those draws rank
+    below every IRR, so IRR quantiles that fall among them are None.
+    """
+    sizes = [min(chunk_size, draws - start) for start in range(0, draws, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    # The hourly dispatch depends only on the PV yield among the uncertain
+    # inputs, so it is simulated once per yield node rather than per draw.
+    nodes = yield_nodes(spec) if hourly else None
+    node_flows = dispatch_at_yields(base, nodes) if hourly else None
+    args = [(base, spec, n, child, nodes, node_flows) for n, child in zip(sizes, seeds)]
+    if len(args) == 1:
+        parts = [run_chunk(*args[0])]
+    else:
+        parts = pool.imap(run_chunk, args)
+
+    total = None
+    for part in parts:   # consumed in chunk order so merges are reproducible
+        total = _merge(total, part)
+
+    def finite(value):
+        return float(value) if np.isfinite(value) else None
+
+    quantiles = [0.1, 0.5, 0.9]
+    summary = {'draws': total['draws'], 'seed': seed, 'years': list(range(1, len(total['cash_flow']) + 1)),
+               'prob_npv_positive': total['npv_positive'] / total['draws'],
+               'irr_undefined': total['irr'].undefined / total['draws']}
+    for name in ('npv', 'irr'):
+        p10, p50, p90 = total[name].quantile(quantiles)
+        centers, counts = total[name].histogram()
+        summary[name] = {'p10': finite(p10), 'p50': finite(p50), 'p90': finite(p90), 'hist_x': centers, 'hist_y': counts}
+    bands = np.array([sketch.quantile(quantiles) for sketch in total['cash_flow']])
+    summary['cash_flow'] = {key: [finite(v) for v in bands[:, i]] for i, key in enumerate(['p10', 'p50', 'p90'])}
+    return summary
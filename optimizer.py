@@ -0,0 +1,118 @@
+"""PV size x battery size design optimizer.
+
+Sweeps a grid of PV kWp and battery kWh against the full cost and revenue
+model. Only the energy flows depend on the swept sizes in a non-trivial way,
+so they are computed once per distinct design and memoized. Price, tax and
+financing inputs can change between sweeps without re-running the dispatch.
+With the hourly dispatch the design space is always searched coarse-to-fine:
+a full grid of up to 200 x 200 designs would take minutes to simulate.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import dispatch
+import engine
+
+METRICS = ['npv', 'irr']
+FLOW_CACHE_SIZE = 50000
+_flow_cache = OrderedDict()
+_flow_lock = threading.Lock()   # sweeps of concurrent requests share the cache
+
+
+def _flow_key(base, hourly):
+    # Everything besides the swept sizes that the energy flows depend on.
+    shapes = tuple(None if base.get(key) is None else hash(np.asarray(base[key]).tobytes()) for key in engine.SHAPE_KEYS)
+    return (bool(hourly), float(base['ev_demand']), float(base.get('pv_yield', engine.AVG_GEN_PER_KWP)), int(base['sim_years'])) + shapes
+
+
+def design_flows(base, pv_sizes, battery_sizes, hourly=False):
+    """Energy flows (N, Y) for each (pv_size, battery_size) design.
+
+    Without hourly dispatch the flows do not depend on the battery, so they
+    are computed once per distinct PV size. With hourly dispatch each design
+    is simulated once and memoized, and only unseen designs are dispatched.
+    """
+    pv_sizes, battery_sizes = np.asarray(pv_sizes, dtype=float), np.asarray(battery_sizes, dtype=float)
+    if not hourly:
+        unique_pv, index = np.unique(pv_sizes, return_inverse=True)
+        batch = engine._as_batch({**base, 'pv_size': unique_pv})
+        years, mask = engine.horizon(batch['sim_years'])
+        pv_generation = engine.generation(batch['pv_size'], batch['pv_yield'], years, mask)
+        flows = engine.energy_flows(pv_generation, batch['ev_demand'], mask)
+        return {key: values[index] for key, values in flows.items()}
+
+    context = _flow_key(base, hourly)
+    keys = [context + design for design in zip(pv_sizes.tolist(), battery_sizes.tolist())]
+    with _flow_lock:
+        found = {key: _flow_cache[key] for key in keys if key in _flow_cache}
+        for key in found:
+            _flow_cache.move_to_end(key)
+    missing = [key for key in OrderedDict.fromkeys(keys) if key not in found]
+    if missing:
+        batch = engine._as_batch({**base, 'pv_size': [key[-2] for key in missing], 'battery_size': [key[-1] for key in missing]})
+        years, mask = engine.horizon(batch['sim_years'])
+        pv_generation = engine.generation(batch['pv_size'], batch['pv_yield'], years, mask)
+        flows = dispatch.simulate(pv_generation, batch['ev_demand'], batch['battery_size'], mask, batch['pv_shape'], batch['load_shape'])
+        computed = {key: {name: values[i] for name, values in flows.items()} for i, key in enumerate(missing)}
+        found.update(computed)
+        with _flow_lock:
+            _flow_cache.update(computed)
+            while len(_flow_cache) > FLOW_CACHE_SIZE:
+                _flow_cache.popitem(last=False)
+    return {name: np.stack([found[key][name] for key in keys]) for name in ('self_consumed', 'grid_import', 'grid_export')}
+
+
+def sweep(base, pv_sizes, battery_sizes, hourly=False):
+    """Evaluate every combination of `pv_sizes` x `battery_sizes`.
+
+    Returns NPV and IRR (percent) as (len(battery_sizes), len(pv_sizes)) grids.
+    """
+    pv_grid, battery_grid = np.meshgrid(np.asarray(pv_sizes, dtype=float), np.asarray(battery_sizes, dtype=float))
+    flows = design_flows(base, pv_grid.ravel(), battery_grid.ravel(), hourly)
+    result = engine.evaluate_batch({**base, 'pv_size': pv_grid.ravel(), 'battery_size': battery_grid.ravel()}, flows=flows)
+    return {'pv_sizes': np.asarray(pv_sizes, dtype=float), 'battery_sizes': np.asarray(battery_sizes, dtype=float),
+            'npv': result['npv'].reshape(pv_grid.shape), 'irr': (result['irr'] * 100).reshape(pv_grid.shape)}
+
+
+def best(grid, metric='npv'):
+    """Return (pv_size, battery_size, value) of the best design in a sweep, or None if all are NaN."""
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+    values = grid[metric]
+    if np.isnan(values).all():
+        return None
+    row, col = np.unravel_index(np.nanargmax(values), values.shape)
+    return grid['pv_sizes'][col], grid['battery_sizes'][row], values[row, col]
+
+
+def optimize(base, pv_range, battery_range, steps=100, metric='npv', method='grid', hourly=False, rounds=3):
+    """Search the PV x battery design space for the design maximizing `metric`.
+
+    'grid' evaluates a full `steps` x `steps` grid. 'refine' evaluates a
+    coarse grid and then repeatedly zooms in around the best design, which
+    keeps the hourly dispatch interactive; it is always used when `hourly`
+    is set. Returns the grid shown to the user (the full grid, or the coarse
+    one for 'refine') and the optimum.
+    """
+    if method == 'grid' and not hourly:
+        grid = sweep(base, np.linspace(*pv_range, steps), np.linspace(*battery_range, steps), hourly)
+        return grid, best(grid, metric)
+
+    coarse = min(steps, 15)
+    grid = sweep(base, np.linspace(*pv_range, coarse), np.linspace(*battery_range, coarse), hourly)
+    optimum = best(grid, metric)
+    pv_lo, pv_hi = pv_range
+    battery_lo, battery_hi = battery_range
+    for _ in range(rounds):
+        if optimum is None:
+            break
+        pv_step, battery_step = (pv_hi - pv_lo) / (coarse - 1), (battery_hi - battery_lo) / (coarse - 1)
+        pv_lo, pv_hi = max(pv_range[0], optimum[0] - pv_step), min(pv_range[1], optimum[0] + pv_step)
+        battery_lo, battery_hi = max(battery_range[0], optimum[1] - battery_step), min(battery_range[1], optimum[1] + battery_step)
+        fine = sweep(base, np.linspace(pv_lo, pv_hi, coarse), np.linspace(battery_lo, battery_hi, coarse), hourly)
+        candidate = best(fine, metric)
+        if candidate is not None and candidate[2] >= optimum[2]:
+            optimum = candidate
+    return grid, optimum
@@ -0,0 +1,49 @@
+"""Process pool shared by the CPU-heavy paths.
+
+Monte Carlo chunks, portfolio chunks and bulk report batches all run on one
+pool of spawned worker processes per server process, so a gunicorn worker
+never holds more than one set of them. Spawned (not forked) workers are safe
+to start from a threaded web server. Whatever a task needs once per worker
+(the chart renderer, the report stylesheet) is set up lazily by the task
+itself on its first run in that worker.
+"""
+import collections
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+WORKERS = int(os.environ.get('FEASIBILITY_WORKERS', 0)) or os.cpu_count()
+
+_executor, _executor_pid = None, None
+
+
+def get_executor(workers=None):
+    """The process's pool, started on first use with `workers` (default WORKERS) processes."""
+    global _executor, _executor_pid
+    # A pool does not survive a fork, so forked server workers each start their own.
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=workers or WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def imap(fn, tasks, workers=None):
+    """Yield `fn(*args)` for each args tuple of the iterable `tasks`, in order.
+
+    Tasks are submitted lazily with at most two per worker in flight, so the
+    input is read only as fast as results are consumed. With one worker they
+    run in this process.
+    """
+    workers = workers or WORKERS
+    if workers == 1:
+        for args in tasks:
+            yield fn(*args)
+        return
+
+    executor, pending = get_executor(workers), collections.deque()
+    for args in tasks:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
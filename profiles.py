@@ -0,0 +1,360 @@
+"""Site load and PV profiles from measured interval data.
+
+Meter exports, typically 15-minute charger and inverter readings over
+several years, are streamed in record batches with pyarrow (CSV or Parquet),
+so memory stays flat however large the file is. Each batch is binned
+straight into per-year hour-of-year sums; nothing else is kept. The result
+is the typical year: the hourly load and PV shapes the hourly dispatch takes
+instead of its synthetic profiles, and the annual totals that replace the EV
+demand and PV yield inputs.
+
+Processed profiles are stored under the hash of the file contents and the
+options they were read with, so a file is parsed once and later runs (or
+other workers) only load the small stored profile.
+
+    python profiles.py meter.csv --load-column charger_kwh --pv-column inverter_kwh --pv-capacity 120
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+import engine
+
+PROFILE_DIR = os.environ.get('FEASIBILITY_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'feasibility_profiles'))
+INPUT_FORMATS = ['csv', 'parquet']
+UNITS = ['kwh', 'kw']        # energy per interval, or mean power over the interval
+TIME_COLUMN, LOAD_COLUMN, PV_COLUMN = 'timestamp', 'load_kwh', 'pv_kwh'
+BLOCK_SIZE = 4 << 20         # bytes of CSV parsed per batch
+BATCH_ROWS = 1 << 20         # Parquet rows per batch
+MIN_COVERAGE = 0.9           # share of the hours a year needs to count towards the profile
+HOURS = 8760                 # 29 February is left out, as in the dispatch
+SERIES = {'load': 'load_shape', 'pv': 'pv_shape'}
+LOADED_PROFILES = 32         # profiles kept in memory per process
+
+_loaded = collections.OrderedDict()
+
+
+# ==============================================================================
+# READING
+# ==============================================================================
+def infer_format(filename, default='csv'):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return {'pq': 'parquet'}.get(extension, extension) or default
+
+
+def _timestamps(column):
+    """Wall-clock datetime64[s] values of a pyarrow column; unparseable values raise ValueError."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    try:
+        if not pa.types.is_timestamp(column.type):
+            column = column.cast(pa.timestamp('s'))
+        elif column.type.tz is not None:
+            column = pc.local_timestamp(column)   # profiles follow local time, as people charge by the clock
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"Could not read timestamps: {e}") from None
+    return column.to_numpy(zero_copy_only=False).astype('datetime64[s]')
+
+
+def read_batches(source, fmt, columns):
+    """Yield (timestamps, {column: float values}) batches from a path or binary file object.
+
+    `columns` maps the role of each value column to its name, with the time
+    column under 'time'. Missing values come back as NaN (and NaT).
+    """
+    import pyarrow as pa
+    if fmt not in INPUT_FORMATS:
+        raise ValueError(f"Unsupported input format '{fmt}', expected one of {INPUT_FORMATS}")
+    names = [name for role, name in columns.items() if role != 'time']
+    try:
+        if fmt == 'csv':
+            import pyarrow.csv as csv
+            batches = csv.open_csv(source, read_options=csv.ReadOptions(block_size=BLOCK_SIZE),
+                                   convert_options=csv.ConvertOptions(include_columns=[columns['time']] + names,
+                                                                      column_types={name: pa.float64() for name in names}))
+        else:
+            import pyarrow.parquet as pq
+            batches = pq.ParquetFile(source).iter_batches(batch_size=BATCH_ROWS, columns=[columns['time']] + names)
+        for batch in batches:
+            values = {role: batch.column(name).cast(pa.float64()).to_numpy(zero_copy_only=False)
+                      for role, name in columns.items() if role != 'time'}
+            yield _timestamps(batch.column(columns['time'])), values
+    except (pa.ArrowInvalid, pa.ArrowKeyError) as e:
+        raise ValueError(f"Could not read the meter data: {e}") from None
+
+
+# ==============================================================================
+# AGGREGATION
+# ==============================================================================
+def hour_of_year(times):
+    """(year, hour 0-8759, on 29 February) for datetime64[s] timestamps."""
+    start = times.astype('datetime64[Y]')
+    hour = (times - start) // np.timedelta64(1, 'h')
+    year = start.astype(np.int64) + 1970
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    feb29 = leap & (hour >= 59 * 24) & (hour < 60 * 24)
+    return year, np.where(leap & (hour >= 60 * 24), hour - 24, hour), feb29
+
+
+class ProfileAccumulator:
+    """Running per-year sums and sample counts of each series by hour of year."""
+
+    def __init__(self, roles):
+        self.roles = list(roles)
+        self.sums = {role: {} for role in self.roles}
+        self.counts = {role: {} for role in self.roles}
+        self.rows = self.invalid = self.clipped = 0
+        self.interval = None   # seconds between readings, from the first batch
+
+    def add(self, times, values):
+        self.rows += len(times)
+        valid_time = ~np.isnat(times)
+        if self.interval is None and valid_time.sum() > 1:
+            steps = np.diff(np.unique(times[valid_time])).astype(np.int64)
+            self.interval = int(np.median(steps))
+        year, hour, feb29 = hour_of_year(np.where(valid_time, times, np.datetime64(0, 's')))
+        usable = valid_time & ~feb29
+        if not usable.any():
+            self.invalid += int((~valid_time).sum())
+            return
+        first = int(year[usable].min())
+        # One bincount per series over (year, hour) pairs of this batch.
+        index = (year - first) * HOURS + hour
+        length = (int(year[usable].max()) - first + 1) * HOURS
+        bad = ~valid_time
+        for role in self.roles:
+            series = values[role]
+            if role == 'pv':
+                # Inverters report small negative readings at night (standby draw).
+                self.clipped += int((series < 0).sum())
+                series = np.maximum(series, 0)
+            ok = usable & np.isfinite(series) & (series >= 0)
+            bad |= valid_time & ~feb29 & ~ok
+            sums = np.bincount(index[ok], weights=series[ok], minlength=length)
+            counts = np.bincount(index[ok], minlength=length)
+            for offset in range(length // HOURS):
+                part = slice(offset * HOURS, (offset + 1) * HOURS)
+                if counts[part].any():
+                    y = first + offset
+                    self.sums[role][y] = self.sums[role].get(y, 0) + sums[part]
+                    self.counts[role][y] = self.counts[role].get(y, 0) + counts[part]
+        self.invalid += int(bad.sum())
+
+    def result(self, unit='kwh'):
+        """The typical-year profile; raises ValueError when the data cannot make one."""
+        if not self.interval or self.interval > 3600 or 3600 % self.interval:
+            raise ValueError(f"Readings must be at most hourly and divide the hour evenly "
+                             f"(found {self.interval or 0} s between readings)")
+        per_hour = 3600 // self.interval
+        profile = {'rows': self.rows, 'invalid_rows': self.invalid, 'clipped_rows': self.clipped,
+                   'interval_minutes': self.interval / 60, 'unit': unit}
+        for role in self.roles:
+            hourly, coverage, duplicates = [], {}, 0
+            for year in sorted(self.counts[role]):
+                counts, sums = self.counts[role][year], self.sums[role][year]
+                covered = counts > 0
+                coverage[str(year)] = float(covered.mean())
+                duplicates += int(np.maximum(counts - per_hour, 0).sum())
+                if covered.mean() < MIN_COVERAGE:
+                    continue
+                # Hours with missing or repeated readings are scaled to a full hour.
+                energy = np.where(covered, sums / np.maximum(counts, 1), np.nan) * (per_hour if unit == 'kwh' else 1)
+                hourly.append(_fill_gaps(energy))
+            if not hourly:
+                raise ValueError(f"No year of '{role}' readings covers {MIN_COVERAGE:.0%} of its hours "
+                                 f"(coverage by year: {coverage})")
+            typical = np.mean(hourly, axis=0)
+            total = float(typical.sum())
+            profile[SERIES[role]] = typical / total if total > 0 else None
+            profile[f'annual_{role}_kwh'] = total
+            profile[f'{role}_years'] = [year for year, share in coverage.items() if share >= MIN_COVERAGE]
+            profile[f'{role}_coverage'] = coverage
+            profile[f'{role}_duplicates'] = duplicates
+        return profile
+
+
+def _fill_gaps(energy):
+    # Each missing hour is interpolated from the same hour of the neighbouring days. An hour of the
+    # day with no readings at all (say a logger that skips 03:00 every night) is then interpolated
+    # from the neighbouring hours of the same day.
+    days = energy.reshape(-1, 24)
+    for hour in range(24):
+        column = days[:, hour]
+        known = ~np.isnan(column)
+        if known.any() and not known.all():
+            column[~known] = np.interp(np.flatnonzero(~known), np.flatnonzero(known), column[known])
+    energy = days.ravel()
+    known = ~np.isnan(energy)
+    if not known.all():
+        energy[~known] = np.interp(np.flatnonzero(~known), np.flatnonzero(known), energy[known])
+    return energy
+
+
+# ==============================================================================
+# STORAGE
+# ==============================================================================
+def profile_key(source, options):
+    """Hash of the file contents and the options it is read with."""
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8'))
+    f = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    finally:
+        if f is source:
+            source.seek(0)
+        else:
+            f.close()
+    return digest.hexdigest()
+
+
+def _path(key):
+    return os.path.join(PROFILE_DIR, f"{key}.npz")
+
+
+def save(key, profile):
+    """Store a profile under `key`: the shapes as arrays, everything else as JSON."""
+    shapes = {name: np.asarray([] if profile.get(name) is None else profile[name]) for name in engine.SHAPE_KEYS}
+    meta = {name: value for name, value in profile.items() if name not in engine.SHAPE_KEYS}
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp_path = f"{_path(key)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **shapes)
+    os.replace(tmp_path, _path(key))   # atomic, so concurrent workers never read a partial file
+
+
+def load(key):
+    """The stored profile `key` (shapes read-only), or None if there is none."""
+    if key in _loaded:
+        return _loaded[key]
+    if not re.fullmatch(r'[0-9a-f]{64}', str(key)):
+        return None
+    try:
+        with np.load(_path(key)) as stored:
+            profile = {'id': key, **json.loads(str(stored['meta']))}
+            for name in engine.SHAPE_KEYS:
+                shape = stored[name]
+                shape.flags.writeable = False
+                profile[name] = shape if len(shape) else None
+    except FileNotFoundError:
+        return None
+    _loaded[key] = profile
+    while len(_loaded) > LOADED_PROFILES:
+        _loaded.popitem(last=False)
+    return profile
+
+
+def ingest(source, fmt='csv', time_column=TIME_COLUMN, load_column=LOAD_COLUMN, pv_column=PV_COLUMN, unit='kwh'):
+    """Read, validate and store the profile of a meter data file, unless it was stored before.
+
+    `source` is a path or a seekable binary file. Either value column may be
+    None when the file only has the other one. Returns the profile dict.
+    """
+    if unit not in UNITS:
+        raise ValueError(f"Unsupported unit '{unit}', expected one of {UNITS}")
+    columns = {role: name for role, name in [('time', time_column), ('load', load_column), ('pv', pv_column)] if name}
+    if len(columns) < 2:
+        raise ValueError("Name a load column, a PV column or both")
+    key = profile_key(source, {'format': fmt, 'columns': columns, 'unit': unit})
+    profile = load(key)
+    if profile is None:
+        accumulator = ProfileAccumulator([role for role in columns if role != 'time'])
+        for times, values in read_batches(source, fmt, columns):
+            accumulator.add(times, values)
+        save(key, accumulator.result(unit))
+        profile = load(key)
+    return profile
+
+
+# ==============================================================================
+# MODEL INPUTS
+# ==============================================================================
+def annual_inputs(profile, pv_capacity=None):
+    """Model inputs a profile measures: the EV demand and, given the metered PV capacity in kWp, the PV yield."""
+    inputs = {}
+    if profile.get('load_shape') is not None:
+        inputs['ev_demand'] = profile['annual_load_kwh']
+    if profile.get('pv_shape') is not None and pv_capacity:
+        inputs['pv_yield'] = profile['annual_pv_kwh'] / pv_capacity
+    return inputs
+
+
+def shapes(key):
+    """The hourly shapes of profile `key` for the dispatch (see engine.SHAPE_KEYS); empty if there is none."""
+    profile = load(key) if key else None
+    return {name: profile[name] for name in engine.SHAPE_KEYS} if profile else {}
+
+
+def describe(profile):
+    """JSON-serializable summary of a profile."""
+    return {name: value for name, value in profile.items() if name not in engine.SHAPE_KEYS}
+
+
+# ==============================================================================
+# FLASK ROUTE
+# ==============================================================================
+def register_routes(server):
+    """Register POST /api/profiles and GET /api/profiles/<id> on the Flask `server`.
+
+    Send the meter file as multipart field `file` (format inferred from its
+    name) or as the raw request body with `?format=csv|parquet`. Query
+    options: `time_column`, `load_column`, `pv_column` (empty for none) and
+    `unit=kwh|kw`. Returns the profile summary with its `id`.
+    """
+    from flask import jsonify, request
+
+    @server.route('/api/profiles', methods=['POST'])
+    def upload_profile():
+        upload = request.files.get('file')
+        fmt = request.args.get('format') or infer_format(upload.filename if upload else None)
+        options = dict(time_column=request.args.get('time_column', TIME_COLUMN),
+                       load_column=request.args.get('load_column', LOAD_COLUMN) or None,
+                       pv_column=request.args.get('pv_column', PV_COLUMN) or None, unit=request.args.get('unit', 'kwh'))
+        with tempfile.TemporaryFile() as source:
+            # Hashing and parsing both read the file, so it is spooled to disk first.
+            shutil.copyfileobj(upload.stream if upload else request.stream, source)
+            source.seek(0)
+            try:
+                profile = ingest(source, fmt, **options)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        return jsonify(describe(profile))
+
+    @server.route('/api/profiles/<key>')
+    def get_profile(key):
+        profile = load(key)
+        return jsonify(describe(profile)) if profile else (jsonify({'error': 'Unknown profile'}), 404)
+
+    return upload_profile, get_profile
+
+
+# ==============================================================================
+# CLI
+# ==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a site load / PV profile from interval meter data.")
+    parser.add_argument('input', help="CSV or Parquet file of meter readings")
+    parser.add_argument('--input-format', choices=INPUT_FORMATS, help="defaults to the input file extension")
+    parser.add_argument('--time-column', default=TIME_COLUMN)
+    parser.add_argument('--load-column', default=LOAD_COLUMN, help="'' if the file has no load readings")
+    parser.add_argument('--pv-column', default=PV_COLUMN, help="'' if the file has no PV readings")
+    parser.add_argument('--unit', choices=UNITS, default='kwh', help="kwh per interval (default) or mean kw")
+    parser.add_argument('--pv-capacity', type=float, help="metered PV capacity in kWp, to report the yield")
+    args = parser.parse_args(argv)
+
+    profile = ingest(args.input, args.input_format or infer_format(args.input), args.time_column,
+                     args.load_column or None, args.pv_column or None, args.unit)
+    summary = describe(profile)
+    summary.update({f'model_{name}': value for name, value in annual_inputs(profile, args.pv_capacity).items()})
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
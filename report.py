@@ -0,0 +1,222 @@
+"""PDF feasibility report rendering and background export jobs.
+
+Reports are rendered off the request path: `jobs.submit` queues a job on a
+per-process worker thread and returns its id, and progress, errors and the
+finished PDF are kept in the shared SQLite file, so any worker can answer
+the browser's status polls. Charts are rebuilt from the cached result data,
+go through a warm kaleido renderer in one batch per call and are cached as
+PNGs by figure content hash. The HTML template, stylesheet, fonts and logo
+are bundled in report_assets/ and loaded once per process, so rendering
+never touches the network. bulk_report.py renders whole portfolios.
+"""
+import base64
+import hashlib
+import html
+import os
+import string
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cache
+import charts
+import metrics
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'report_assets')
+CHART_CACHE_DIR = os.environ.get('FEASIBILITY_CHART_CACHE', os.path.join(tempfile.gettempdir(), 'feasibility_charts'))
+CHART_CACHE_MAX_FILES = int(os.environ.get('FEASIBILITY_CHART_CACHE_MAX_FILES', 2000))
+CHART_SIZE = dict(width=900, height=450, scale=2)
+
+_renderer_lock = threading.Lock()
+_renderer_started = False
+_stylesheet = None
+_template = None
+
+
+# ==============================================================================
+# RENDERING
+# ==============================================================================
+def warm_renderer():
+    """Start kaleido's long-lived browser once per process so later charts skip its startup.
+
+    Servers call it when a worker starts (see gunicorn.conf.py); otherwise the first render does.
+    """
+    global _renderer_started
+    with _renderer_lock:
+        if not _renderer_started:
+            import kaleido
+            if hasattr(kaleido, 'start_sync_server'):
+                # Without a browser the server thread dies and every later render would block forever.
+                from choreographer.browsers.chromium import Chromium
+                if Chromium.find_browser(skip_local=False) is None:
+                    raise RuntimeError("Chart rendering needs Chrome; install it with `kaleido_get_chrome`")
+                kaleido.start_sync_server(silence_warnings=True)
+            _renderer_started = True
+
+
+def _chart_path(fig):
+    digest = hashlib.sha256(f"{fig.to_json()}|{CHART_SIZE}".encode('utf-8')).hexdigest()
+    return os.path.join(CHART_CACHE_DIR, f"{digest}.png")
+
+
+def render_charts(figures):
+    """PNG bytes of each figure; the ones not rendered before go through kaleido in a single batch."""
+    paths, pngs, missing = [_chart_path(fig) for fig in figures], {}, {}
+    for fig, path in zip(figures, paths):
+        try:
+            with open(path, 'rb') as f:
+                pngs[path] = f.read()
+        except FileNotFoundError:
+            missing[path] = fig
+    if missing:
+        import plotly.io as pio
+        os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+        tmp_paths = [f"{path}.{os.getpid()}.tmp" for path in missing]
+        with metrics.timed('kaleido'):
+            warm_renderer()
+            pio.write_images(list(missing.values()), tmp_paths, format="png", **CHART_SIZE)
+        for path, tmp_path in zip(missing, tmp_paths):
+            with open(tmp_path, 'rb') as f:
+                pngs[path] = f.read()
+            os.replace(tmp_path, path)   # atomic, so concurrent workers never read a partial file
+        _prune_chart_cache()
+    return [pngs[path] for path in paths]
+
+
+def render_chart(fig):
+    """PNG bytes of a figure, reusing a cached render when the same figure was rendered before."""
+    return render_charts([fig])[0]
+
+
+def _prune_chart_cache():
+    entries = [entry for entry in os.scandir(CHART_CACHE_DIR) if entry.name.endswith('.png')]
+    if len(entries) > CHART_CACHE_MAX_FILES:
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - CHART_CACHE_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def _get_stylesheet():
+    # Parsed once per process; the bundled @font-face rules need a shared FontConfiguration.
+    global _stylesheet
+    if _stylesheet is None:
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+        font_config = FontConfiguration()
+        _stylesheet = (CSS(filename=os.path.join(ASSETS_DIR, 'report.css'), font_config=font_config), font_config)
+    return _stylesheet
+
+
+def _get_template():
+    # Read and compiled once per process; only the substitution runs per report.
+    global _template
+    if _template is None:
+        with open(os.path.join(ASSETS_DIR, 'report.html'), encoding='utf-8') as f:
+            _template = string.Template(f.read())
+    return _template
+
+
+def _table_html(columns):
+    head = ''.join(f"<th>{html.escape(name)}</th>" for name in columns)
+    formats = [(lambda x: f'€ {x:,.0f}') if '€' in name else str for name in columns]
+    rows = ''.join('<tr>' + ''.join(f"<td>{fmt(value)}</td>" for fmt, value in zip(formats, row)) + '</tr>'
+                   for row in zip(*columns.values()))
+    return f'<table class="results-table"><thead><tr>{head}</tr></thead><tbody>{rows}</tbody></table>'
+
+
+def report_html(data, cash_flow_png, co2_png):
+    """HTML for the report body; assets are referenced relative to ASSETS_DIR."""
+    inputs, kpis = data['inputs'], data['kpis']
+    return _get_template().substitute(
+        project_name=html.escape(str(inputs['project_name'])), generated=datetime.now().strftime('%Y-%m-%d'),
+        npv=kpis['npv'], irr=kpis['irr'], payback=kpis['payback'], co2_saved=kpis['co2_saved'],
+        pv_size=inputs['pv_size'], sim_years=inputs['sim_years'], battery_size=inputs['battery_size'],
+        ev_demand=f"{inputs['ev_demand']:,}", infra_cost=f"{inputs['infra_cost']:,}", pv_cost=f"{inputs['pv_cost']:,}",
+        battery_cost=f"{inputs['battery_cost']:,}", grid_price=inputs['grid_price'], feed_in_tariff=inputs['feed_in_tariff'],
+        energy_model='Hourly battery dispatch' if inputs.get('hourly_dispatch') else 'Fixed self-consumption ratio',
+        profiles='Measured site data' if inputs.get('site_profile') else 'Synthetic',
+        cash_flow_png=base64.b64encode(cash_flow_png).decode('ascii'), co2_png=base64.b64encode(co2_png).decode('ascii'),
+        table=_table_html(data['cash_flow_df']))
+
+
+def report_figures(data, mc_data=None):
+    """The cash flow and CO₂ figures of a result set, laid out for print."""
+    figures = [charts.cash_flow_figure(data, mc_data), charts.co2_figure(data)]
+    for fig in figures:
+        fig.update_layout(margin=dict(l=60, r=40, t=80, b=60), legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    return figures
+
+
+def build_report(data, mc_data=None, progress=None):
+    """Render the PDF report for one result set (with Monte Carlo bands if `mc_data` is given).
+
+    `progress(percent, message)` is called along the way.
+    """
+    progress = progress or (lambda percent, message: None)
+    progress(10, "Rendering charts")
+    pngs = render_charts(report_figures(data, mc_data))
+    progress(75, "Typesetting PDF")
+    return typeset(report_html(data, *pngs))
+
+
+def typeset(html_string):
+    """PDF bytes of a report HTML string."""
+    from weasyprint import HTML
+    with metrics.timed('weasyprint'):
+        stylesheet, font_config = _get_stylesheet()
+        return HTML(string=html_string, base_url=ASSETS_DIR).write_pdf(stylesheets=[stylesheet], font_config=font_config)
+
+
+# ==============================================================================
+# BACKGROUND JOBS
+# ==============================================================================
+class ReportJobs(cache.JobStore):
+    """Queue of PDF export jobs with progress, shared across workers through SQLite."""
+    SCHEMA = ['CREATE TABLE IF NOT EXISTS report_jobs (id TEXT PRIMARY KEY, status TEXT, progress INTEGER, '
+              'message TEXT, updated REAL, filename TEXT, pdf BLOB)']
+    TABLE, FIELDS = 'report_jobs', ['progress']
+    TIMEOUT_MESSAGE = 'Report timed out'
+
+    def __init__(self, path=cache.CACHE_PATH):
+        super().__init__(path)
+        self._executor, self._executor_pid = None, None
+
+    def _get_executor(self):
+        # Threads do not survive a fork, so each worker process gets its own.
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf-report')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, data, mc_data=None):
+        """Queue a report for `data` and return the job id."""
+        job_id, now = uuid.uuid4().hex, time.time()
+        self._expire(now)
+        self._connection().execute("INSERT INTO report_jobs VALUES (?, 'queued', 0, 'Queued', ?, ?, NULL)",
+                                   (job_id, now, f"Feasibility_Report_{data['inputs']['project_name']}.pdf"))
+        self._get_executor().submit(self._run, job_id, data, mc_data)
+        return job_id
+
+    def _run(self, job_id, data, mc_data):
+        try:
+            self._update(job_id, status='running')
+            pdf = build_report(data, mc_data,
+                               progress=lambda percent, message: self._update(job_id, progress=percent, message=message))
+            self._update(job_id, status='done', progress=100, message='Report ready', pdf=pdf)
+        except Exception as e:
+            self._update(job_id, status='failed', message=f"Report failed: {e}")
+
+    def result(self, job_id):
+        """Return (filename, pdf_bytes) of a finished job, or None."""
+        row = self._connection().execute("SELECT filename, pdf FROM report_jobs WHERE id = ? AND status = 'done'",
+                                         (job_id,)).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+
+jobs = ReportJobs()
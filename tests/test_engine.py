@@ -0,0 +1,31 @@
+"""Parity of the batched NPV/IRR in engine.py with numpy-financial."""
+import numpy as np
+import numpy_financial as npf
+
+import engine
+
+
+def _cash_flows(n=2000, years=26, seed=7):
+    rng = np.random.default_rng(seed)
+    cash_flows = rng.normal(1, 1.5, (n, years))
+    cash_flows[:, 0] = -rng.uniform(2, 40, n)
+    cash_flows[: n // 10, 5:] *= -1             # non-conventional: several sign changes
+    cash_flows[n // 10: n // 5] = np.abs(cash_flows[n // 10: n // 5])   # all positive: no root
+    cash_flows[n // 5: n // 5 + 20, 3] = np.nan
+    cash_flows[n // 5 + 20] = 0                 # all zero: npf.irr gives NaN
+    return cash_flows
+
+
+def test_irr_matches_numpy_financial():
+    cash_flows = _cash_flows()
+    # npf.irr raises on NaN input; the batched version returns NaN for those rows.
+    expected = np.array([npf.irr(row) if np.isfinite(row).all() else np.nan for row in cash_flows])
+    assert np.isnan(expected[200:421]).all()     # the all-positive (no root), NaN and all-zero rows
+    np.testing.assert_allclose(engine.irr(cash_flows), expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_npv_matches_numpy_financial():
+    cash_flows = _cash_flows()
+    rates = np.random.default_rng(3).uniform(-0.05, 0.2, len(cash_flows))
+    expected = np.array([npf.npv(rate, row) for rate, row in zip(rates, cash_flows)])
+    np.testing.assert_allclose(engine.npv(rates, cash_flows), expected, rtol=1e-9, equal_nan=True)
@@ -0,0 +1,46 @@
+"""Incremental ModelGraph evaluation against full engine.evaluate_batch runs."""
+import numpy as np
+
+import engine
+from model_graph import ModelGraph
+
+BASE = engine.parse_inputs(['Test', 20, 150, 200, 30000, 900, 450, 100000, 1.5, 0.18, 0.07, 2.0, 70, 4.5,
+                            8.0, 25, 0.401, 35])
+
+
+def _assert_same(values, expected):
+    assert values.keys() == expected.keys()
+    for key in expected:
+        np.testing.assert_array_equal(values[key], expected[key], err_msg=key)
+
+
+def test_random_edits_match_full_evaluation():
+    rng = np.random.default_rng(11)
+    graph, inputs, hourly = ModelGraph(), dict(BASE), False
+    _assert_same(graph.evaluate(inputs, hourly), engine.evaluate_batch(inputs, hourly))
+    for _ in range(40):
+        key = rng.choice(engine.MODEL_KEYS + ['hourly'])
+        if key == 'hourly':
+            hourly = not hourly
+        elif key == 'sim_years':
+            inputs[key] = int(rng.integers(5, 31))
+        else:
+            inputs[key] = inputs[key] * rng.uniform(0.5, 1.5)
+        _assert_same(graph.evaluate(inputs, hourly), engine.evaluate_batch(inputs, hourly))
+
+
+def test_price_and_tax_edits_rerun_only_downstream_stages():
+    graph = ModelGraph()
+    graph.evaluate(BASE)
+    graph.evaluate({**BASE, 'co2_price': BASE['co2_price'] * 2})
+    assert graph.last_run == ['opex_revenue', 'profit_and_loss', 'cash_flow', 'kpis']
+    graph.evaluate({**BASE, 'co2_price': BASE['co2_price'] * 2, 'tax_rate': 0.3})
+    assert graph.last_run == ['profit_and_loss', 'cash_flow', 'kpis']
+
+
+def test_uncommitted_evaluation_keeps_state():
+    graph = ModelGraph()
+    base = graph.evaluate(BASE)
+    graph.evaluate({**BASE, 'grid_price': 0.3}, commit=False)
+    assert graph.evaluate(BASE)['npv'] == base['npv']
+    assert graph.last_run == []
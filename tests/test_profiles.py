@@ -0,0 +1,94 @@
+"""Typical-year profiles from synthetic 15-minute meter files."""
+import numpy as np
+import pytest
+
+import profiles
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiles, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    profiles._loaded.clear()
+
+
+def _times(start, end, minutes=15):
+    return np.arange(np.datetime64(start), np.datetime64(end), np.timedelta64(minutes, 'm'))
+
+
+def _hour_of_day(times):
+    return ((times - times.astype('datetime64[D]')) // np.timedelta64(1, 'h')).astype(int)
+
+
+def _write_csv(path, times, load, pv=None):
+    columns = [times.astype('datetime64[s]').astype(str), load] + ([] if pv is None else [pv])
+    header = 'timestamp,load_kwh' + ('' if pv is None else ',pv_kwh')
+    with open(path, 'w') as f:
+        f.write(header + '\n')
+        f.writelines(','.join(str(value) for value in row) + '\n' for row in zip(*columns))
+    return str(path)
+
+
+def test_hour_of_year_folds_out_february_29():
+    times = np.array(['2024-02-28T23:00', '2024-02-29T12:00', '2024-03-01T00:00', '2023-03-01T00:00',
+                      '2024-12-31T23:00'], dtype='datetime64[s]')
+    year, hour, feb29 = profiles.hour_of_year(times)
+    assert year.tolist() == [2024, 2024, 2024, 2023, 2024]
+    assert feb29.tolist() == [False, True, False, False, False]
+    assert hour[2] == hour[3] == 59 * 24
+    assert hour[4] == profiles.HOURS - 1
+
+
+def test_leap_year_gives_8760_hours(tmp_path):
+    times = _times('2024-01-01', '2025-01-01')
+    profile = profiles.ingest(_write_csv(tmp_path / 'leap.csv', times, np.full(len(times), 0.25)), pv_column=None)
+    assert profile['interval_minutes'] == 15
+    assert profile['invalid_rows'] == 0
+    assert profile['annual_load_kwh'] == pytest.approx(8760)
+    np.testing.assert_allclose(profile['load_shape'], 1 / 8760)
+
+
+def test_hour_of_day_without_readings_is_filled_from_neighbouring_hours(tmp_path):
+    times = _times('2021-01-01', '2023-01-01')
+    times = times[_hour_of_day(times) != 3]
+    load = 0.25 * (1 + 0.1 * _hour_of_day(times))
+    profile = profiles.ingest(_write_csv(tmp_path / 'gap.csv', times, load), pv_column=None)
+    hourly = profile['load_shape'] * profile['annual_load_kwh']
+    np.testing.assert_allclose(hourly[:6], [1.0, 1.1, 1.2, 1.3, 1.4, 1.5])
+    assert profile['load_years'] == ['2021', '2022']
+
+
+def test_kw_readings_are_mean_power(tmp_path):
+    times = _times('2023-01-01', '2024-01-01')
+    path = _write_csv(tmp_path / 'meter.csv', times, np.full(len(times), 2.0), np.full(len(times), 1.0))
+    energy, power = profiles.ingest(path, unit='kwh'), profiles.ingest(path, unit='kw')
+    assert energy['annual_load_kwh'] == pytest.approx(8 * 8760)
+    assert power['annual_load_kwh'] == pytest.approx(2 * 8760)
+    assert power['annual_pv_kwh'] == pytest.approx(8760)
+    assert energy['id'] != power['id']
+
+
+def test_duplicate_readings_are_averaged(tmp_path):
+    times = _times('2023-01-01', '2024-01-01')
+    times, load = np.concatenate([times, times[:96]]), np.concatenate([np.full(len(times), 0.25), np.full(96, 0.75)])
+    profile = profiles.ingest(_write_csv(tmp_path / 'dup.csv', times, load), pv_column=None)
+    assert profile['load_duplicates'] == 96
+    assert profile['annual_load_kwh'] == pytest.approx(8760 + 24)
+
+
+def test_years_below_coverage_are_left_out(tmp_path):
+    full, partial = _times('2022-01-01', '2023-01-01'), _times('2023-01-01', '2023-07-01')
+    times = np.concatenate([full, partial])
+    load = np.concatenate([np.full(len(full), 0.25), np.full(len(partial), 1.0)])
+    profile = profiles.ingest(_write_csv(tmp_path / 'partial.csv', times, load), pv_column=None)
+    assert profile['load_years'] == ['2022']
+    assert profile['load_coverage']['2023'] < profiles.MIN_COVERAGE
+    assert profile['annual_load_kwh'] == pytest.approx(8760)
+
+    with pytest.raises(ValueError, match='covers'):
+        profiles.ingest(_write_csv(tmp_path / 'short.csv', partial, np.ones(len(partial))), pv_column=None)
+
+
+def test_uneven_interval_is_rejected(tmp_path):
+    times = _times('2023-01-01', '2024-01-01', minutes=7)
+    with pytest.raises(ValueError, match='divide the hour'):
+        profiles.ingest(_write_csv(tmp_path / 'odd.csv', times, np.ones(len(times))), pv_column=None)